@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("OPEN_API_KEY", "stub")  # the stub never calls the real API
+import translate
+
+WORDS = [
+    "buty", "skórzane", "materiał", "rozmiar", "wkładka", "podeszwa", "kolor",
+    "czarny", "wygodne", "na", "co", "dzień", "wysyłka", "w", "ciągu", "24h",
+]
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+class StubCompletions:
+    """
+    Local stand-in for client.chat.completions that echoes the user message back.
+
+    Every call sleeps for a fixed round-trip latency plus a per-token cost, which is
+    enough to compare request overhead against payload size without the real API.
+    """
+
+    def __init__(self, latency, token_latency):
+        self.latency = latency
+        self.token_latency = token_latency
+        self.calls = 0
+        self.tokens = 0
+
+    def create(self, model, messages, **kwargs):
+        content = messages[-1]["content"]
+        tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        self.calls += 1
+        self.tokens += tokens
+        time.sleep(self.latency + tokens * self.token_latency)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=tokens, completion_tokens=tokens),
+        )
+
+
+class AsyncStubCompletions(StubCompletions):
+    async def create(self, model, messages, **kwargs):
+        content = messages[-1]["content"]
+        tokens = sum(estimate_tokens(message["content"]) for message in messages)
+        self.calls += 1
+        self.tokens += tokens
+        await asyncio.sleep(self.latency + tokens * self.token_latency)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=content))],
+            usage=SimpleNamespace(prompt_tokens=tokens, completion_tokens=tokens),
+        )
+
+
+class StubClient:
+    def __init__(self, latency, token_latency, completions_class=StubCompletions):
+        self.chat = SimpleNamespace(
+            completions=completions_class(latency, token_latency)
+        )
+
+
+def generate_html(paragraphs, seed=0):
+    rng = random.Random(seed)
+    parts = ["<div>"]
+    for i in range(paragraphs):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 20)))
+        parts.append(
+            f"<h3>Sekcja {i}</h3><p>{text} <b>{rng.choice(WORDS)}</b> {text}.</p>"
+        )
+    parts.append("</div>")
+    return "".join(parts)
+
+
+def run(html_content, batch_size, concurrency, latency, token_latency):
+    translate.client = StubClient(latency, token_latency)
+    translate.async_client = StubClient(latency, token_latency, AsyncStubCompletions)
+    stub = translate.async_client if concurrency > 0 else translate.client
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        translate.split_and_translate_html(
+            html_content, "niemiecki", batch_size, concurrency
+        )
+    elapsed = time.perf_counter() - start
+    return elapsed, stub.chat.completions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark batch size against latency with a stubbed chat endpoint"
+    )
+    parser.add_argument("--paragraphs", type=int, default=100)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Round-trip seconds per request"
+    )
+    parser.add_argument(
+        "--token-latency", type=float, default=0.0001, help="Seconds per token"
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[0, 10, 25, 50, 100]
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=translate.CHUNK_TOKENS,
+        help="Token budget per request used by the chunker",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="Async requests in flight (0 runs the serial path)",
+    )
+    args = parser.parse_args()
+
+    translate.CHUNK_TOKENS = args.chunk_tokens
+    html_content = generate_html(args.paragraphs)
+    print(
+        f"{'batch':>6} {'async':>6} {'requests':>9} {'tokens':>8} {'seconds':>9} {'tokens/s':>9}"
+    )
+    for concurrency in args.concurrency:
+        for batch_size in args.batch_sizes:
+            elapsed, stats = run(
+                html_content, batch_size, concurrency, args.latency, args.token_latency
+            )
+            print(
+                f"{batch_size:>6} {concurrency:>6} {stats.calls:>9} {stats.tokens:>8} "
+                f"{elapsed:>9.3f} {stats.tokens / elapsed:>9.0f}"
+            )
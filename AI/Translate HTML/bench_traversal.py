@@ -0,0 +1,95 @@
+import argparse
+import os
+import random
+import time
+import tracemalloc
+
+os.environ.setdefault("OPEN_API_KEY", "stub")  # no requests are made
+import translate
+from bs4 import BeautifulSoup, FeatureNotFound, NavigableString, Tag
+
+WORDS = ["buty", "materiał", "rozmiar", "podeszwa", "kolor", "wysyłka", "24h"]
+
+
+def identity(text, *args, **kwargs):
+    return text
+
+
+def generate_html(sections, depth, seed=0):
+    """Builds nested div/ol/li/p sections, the shape that made the old traversal redundant."""
+    rng = random.Random(seed)
+
+    def block(level):
+        text = " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12)))
+        if level == 0:
+            return f"<p>{text} <b>{rng.choice(WORDS)}</b></p>"
+        items = "".join(f"<li>{block(level - 1)}</li>" for _ in range(2))
+        return f"<div><h3>{text}</h3><ol>{items}</ol></div>"
+
+    return "".join(block(depth) for _ in range(sections))
+
+
+def legacy_split_and_translate_html(html_content):
+    """The previous implementation: nested find_all, marker attribute and a second parse."""
+
+    def translate_html_section(section):
+        if isinstance(section, Tag):
+            if section.get("data-translated") == "true":
+                return
+            for child in section.contents:
+                translate_html_section(child)
+            section["data-translated"] = "true"
+        elif isinstance(section, NavigableString):
+            section.replace_with(identity(str(section)))
+
+    soup = BeautifulSoup(html_content, "html.parser")
+    for section in soup.find_all(translate.TRANSLATABLE_TAGS):
+        translate_html_section(section)
+    soup = BeautifulSoup(str(soup), "html.parser")
+    for tag in soup.find_all(True, {"data-translated": "true"}):
+        del tag["data-translated"]
+    return str(soup)
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    start = time.perf_counter()
+    function(*args)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare the old and the single-pass HTML traversal"
+    )
+    parser.add_argument("--sections", type=int, default=500)
+    parser.add_argument("--depth", type=int, default=4)
+    args = parser.parse_args()
+
+    translate.translate_text = identity
+    html_content = generate_html(args.sections, args.depth)
+    print(f"Synthetic document: {len(html_content) / 1024:.0f} KB")
+
+    candidates = [
+        ("legacy", legacy_split_and_translate_html, html_content),
+        ("single pass", translate.split_and_translate_html, html_content, "pl"),
+    ]
+    try:
+        BeautifulSoup("", "lxml")
+        candidates.append(
+            (
+                "single pass lxml",
+                lambda html: translate.split_and_translate_html(html, "pl", parser="lxml"),
+                html_content,
+            )
+        )
+    except FeatureNotFound:
+        print("lxml not installed, skipping the lxml run")
+
+    print(f"{'variant':<18} {'seconds':>9} {'peak MB':>9}")
+    for name, function, *function_args in candidates:
+        elapsed, peak = measure(function, *function_args)
+        print(f"{name:<18} {elapsed:>9.3f} {peak / 1024 / 1024:>9.1f}")
@@ -1,11 +1,242 @@
 from dotenv import load_dotenv
-from openai import OpenAI
-from bs4 import BeautifulSoup, NavigableString, Tag
+from openai import (
+    APIConnectionError,
+    AsyncOpenAI,
+    InternalServerError,
+    OpenAI,
+    RateLimitError,
+)
+from bs4 import BeautifulSoup, FeatureNotFound, NavigableString, Tag
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import asyncio
+import copy
+import hashlib
+import html
+import json
 import os
+import random
 import re
+import sqlite3
+import time
+
+try:
+    import tiktoken
+except ImportError:  # optional, token counts fall back to an estimate
+    tiktoken = None
 
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPEN_API_KEY"))
+# Retries are handled by complete_async so 429 responses go through the rate limiter
+async_client = AsyncOpenAI(api_key=os.getenv("OPEN_API_KEY"), max_retries=0)
+
+MODEL = "gpt-3.5-turbo-1106"
+try:
+    encoding = tiktoken.encoding_for_model(MODEL) if tiktoken else None
+except Exception:  # the encoding is downloaded on first use
+    encoding = None
+TRANSLATABLE_TAGS = [
+    "div", "h1", "h2", "h3", "h4", "h5", "h6", "p", "ol", "li"
+]  # Add more tags as needed
+INLINE_TAGS = [
+    "a", "abbr", "b", "br", "code", "em", "i", "mark", "small", "span", "strong",
+    "sub", "sup", "u",
+]  # translated together with the surrounding text
+PARSER = "html.parser"  # "lxml" is faster on large documents when installed
+BATCH_SIZE = 40  # segments per request in batched mode
+CHUNK_TOKENS = 1500  # source tokens per request, longer segments are split at sentences
+MAX_COMPLETION_TOKENS = 4000
+MAX_CONCURRENCY = 16  # requests in flight in async mode
+REQUESTS_PER_MINUTE = 3500
+TOKENS_PER_MINUTE = 160000
+MAX_RETRIES = 6
+MEMORY_PATH = "translation_memory.db"
+MEMORY_MAX_ENTRIES = 100000
+MANIFEST_NAME = "translation_manifest.json"
+DIRECTORY_ROUND = 200  # files translated before the manifests are saved
+SEGMENT_MARKER = "\ue000{}\ue001"  # private use characters, never found in the source
+SEGMENT_PATTERN = re.compile("\ue000(\\d+)\ue001")
+PLACEHOLDER_PATTERN = re.compile(r"<(/?)g(\d+)>|<x(\d+)/>")
+PLACEHOLDER_SPLIT = re.compile(r"(</?g\d+>|<x\d+/>)")
+SENTENCE_END = re.compile(r"(?<=[.!?…])\s+")
+
+
+class TranslationMemory:
+    """
+    SQLite-backed cache of finished translations.
+
+    Entries are keyed by the whitespace-normalized source text, both languages and the
+    model, so repeated strings are translated once across runs. When the table grows
+    past max_entries the least recently used entries are evicted.
+    """
+
+    def __init__(self, path=MEMORY_PATH, max_entries=MEMORY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.pending_writes = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS memory (
+                key TEXT PRIMARY KEY,
+                source_language TEXT,
+                target_language TEXT,
+                model TEXT,
+                source_text TEXT,
+                translation TEXT,
+                last_used INTEGER
+            )
+            """
+        )
+        self.connection.execute(
+            "CREATE INDEX IF NOT EXISTS memory_last_used ON memory (last_used)"
+        )
+        self.connection.commit()
+
+    @staticmethod
+    def normalize(text):
+        return " ".join(text.split())
+
+    def make_key(self, text, target_language, source_language, model):
+        parts = [self.normalize(text), source_language, target_language, model]
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def get(self, text, target_language, source_language, model=MODEL):
+        key = self.make_key(text, target_language, source_language, model)
+        row = self.connection.execute(
+            "SELECT translation FROM memory WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.connection.execute(
+            "UPDATE memory SET last_used = ? WHERE key = ?", (time.time_ns(), key)
+        )
+        self._written()
+        return row[0]
+
+    def put(self, text, translation, target_language, source_language, model=MODEL):
+        key = self.make_key(text, target_language, source_language, model)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO memory VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                key,
+                source_language,
+                target_language,
+                model,
+                self.normalize(text),
+                translation,
+                time.time_ns(),
+            ),
+        )
+        self._written()
+
+    def _written(self):
+        self.pending_writes += 1
+        if self.pending_writes >= 100:
+            self.flush()
+
+    def evict(self):
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM memory").fetchone()
+        if count > self.max_entries:
+            self.connection.execute(
+                "DELETE FROM memory WHERE key IN "
+                "(SELECT key FROM memory ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,),
+            )
+
+    def flush(self):
+        self.evict()
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        hit_rate = (self.hits / lookups * 100) if lookups else 0
+        return f"Translation memory: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)"
+
+
+memory = None  # set to a TranslationMemory to reuse earlier translations
+
+
+def is_translatable(text):
+    return bool(text.strip()) and re.search(r"[\w]", text) is not None
+
+
+def count_tokens(text):
+    if encoding is not None:
+        return len(encoding.encode(text))
+    # Rough estimate, about four characters per token
+    return max(1, len(text) // 4)
+
+
+def completion_budget(messages):
+    # Room for a translation about twice as long as the source, instead of a fixed cap
+    tokens = count_tokens(messages[-1]["content"])
+    return min(MAX_COMPLETION_TOKENS, tokens * 2 + 64)
+
+
+def text_messages(text, target_language, source_language):
+    return [
+        {
+            "role": "system",
+            "content": f"Zadanie: Przetłumacz wiadomość użytkownika z języka {source_language}iego na {target_language}. Nie tłumacz danych osobowych i adresowych. Zachowaj znaczniki <g1>, </g1>, <x2/> bez zmian. Zwróć tylko tłumaczenie, nic więcej.",
+        },
+        {"role": "user", "content": text},
+    ]
+
+
+def batch_messages(segments, target_language, source_language):
+    return [
+        {
+            "role": "system",
+            "content": f"Zadanie: Przetłumacz wartości obiektu JSON z języka {source_language}iego na {target_language}. Nie tłumacz danych osobowych i adresowych. Zachowaj znaczniki <g1>, </g1>, <x2/> bez zmian. Nie zmieniaj kluczy. Zwróć tylko obiekt JSON z tymi samymi kluczami, nic więcej.",
+        },
+        {"role": "user", "content": json.dumps(segments, ensure_ascii=False)},
+    ]
+
+
+def parse_batch_response(content, segments):
+    result = json.loads(content)
+    return {
+        segment_id: value.strip()
+        for segment_id, value in result.items()
+        if segment_id in segments and isinstance(value, str)
+    }
+
+
+def split_by_memory(segments, target_language, source_language):
+    """Returns translations found in the memory and the segments still to translate."""
+    if memory is None:
+        return {}, segments
+    cached = {}
+    for segment_id, text in segments.items():
+        translation = memory.get(text, target_language, source_language)
+        if translation is not None:
+            cached[segment_id] = translation
+    missing = {k: v for k, v in segments.items() if k not in cached}
+    return cached, missing
+
+
+def remember(segments, translations, target_language, source_language):
+    if memory is not None:
+        for segment_id, translation in translations.items():
+            memory.put(segments[segment_id], translation, target_language, source_language)
+
+
+class Untranslated(str):
+    """
+    Source text returned in place of a translation when the request failed.
+
+    It renders like the source, so single documents still come out complete, but
+    directory mode can tell it apart and leave the document to be retried.
+    """
 
 
 def translate_text(
@@ -13,60 +244,898 @@ def translate_text(
     target_language,
     source_language="Polski",
 ):
-    if not text.strip() or not re.search("[\w]", text):
+    if not is_translatable(text):
         return text
+    if memory is not None:
+        cached = memory.get(text, target_language, source_language)
+        if cached is not None:
+            return cached
+    messages = text_messages(text, target_language, source_language)
     try:
         response = client.chat.completions.create(
-            model="gpt-3.5-turbo-1106",
-            messages=[
-                {
-                    "role": "system",
-                    "content": f"Zadanie: Przetłumacz wiadomość użytkownika z języka {source_language}iego na {target_language}. Nie tłumacz danych osobowych i adresowych. Zwróć tylko tłumaczenie, nic więcej.",
-                },
-                {"role": "user", "content": text},
-            ],
-            max_tokens=4000,
+            model=MODEL,
+            messages=messages,
+            max_tokens=completion_budget(messages),
             temperature=0.5,
         )
-        print(
-            f"{source_language}: {text.strip()} -{target_language}: {response.choices[0].message.content.strip()}\n"
+        translation = response.choices[0].message.content.strip()
+        print(f"{source_language}: {text.strip()} -{target_language}: {translation}\n")
+        if memory is not None:
+            memory.put(text, translation, target_language, source_language)
+        return translation
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return Untranslated(text)
+
+
+def translate_batch(
+    segments,
+    target_language,
+    source_language="Polski",
+):
+    """
+    Translates many text segments with a single chat completion request.
+
+    The segments are sent as a JSON object and the model is asked to return the same
+    object with translated values. Segments missing from the answer, or all of them if
+    the answer cannot be parsed, are translated one by one with translate_text.
+
+    Args:
+    segments (dict): Segment ID to source text.
+    target_language (str): Language to translate into.
+    source_language (str): Language of the source text.
+
+    Returns:
+    dict: Segment ID to translated text.
+    """
+    translated, segments = split_by_memory(segments, target_language, source_language)
+    if not segments:
+        return translated
+
+    messages = batch_messages(segments, target_language, source_language)
+    fetched = {}
+    try:
+        response = client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            response_format={"type": "json_object"},
+            max_tokens=completion_budget(messages),
+            temperature=0.5,
         )
-        return response.choices[0].message.content.strip()
+        fetched = parse_batch_response(response.choices[0].message.content, segments)
+        print(f"Batch of {len(segments)} segments -{target_language}: {len(fetched)} translated")
     except Exception as e:
         print(f"An error occurred: {e}")
+
+    remember(segments, fetched, target_language, source_language)
+    translated.update(fetched)
+
+    for segment_id, text in segments.items():
+        if segment_id not in translated:
+            translated[segment_id] = translate_text(text, target_language, source_language)
+    return translated
+
+
+class RateLimiter:
+    """
+    Token bucket limiting both requests per minute and tokens per minute.
+
+    Both buckets refill continuously. acquire() waits until one request and the
+    estimated number of tokens are available, so concurrent coroutines queue up here
+    instead of running into 429 responses. The lock is created in the event loop that
+    uses it, so one limiter can be shared by several asyncio.run calls.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute=REQUESTS_PER_MINUTE,
+        tokens_per_minute=TOKENS_PER_MINUTE,
+    ):
+        self.capacity = {"requests": requests_per_minute, "tokens": tokens_per_minute}
+        self.available = dict(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = None
+        self.loop = None
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated
+        self.updated = now
+        for bucket, capacity in self.capacity.items():
+            self.available[bucket] = min(
+                capacity, self.available[bucket] + capacity * elapsed / 60
+            )
+
+    async def acquire(self, tokens):
+        wanted = {"requests": 1, "tokens": min(tokens, self.capacity["tokens"])}
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.lock = asyncio.Lock()
+            self.loop = loop
+        async with self.lock:
+            while True:
+                self._refill()
+                if all(self.available[b] >= wanted[b] for b in wanted):
+                    for bucket, amount in wanted.items():
+                        self.available[bucket] -= amount
+                    return
+                wait = max(
+                    (wanted[b] - self.available[b]) * 60 / self.capacity[b]
+                    for b in wanted
+                )
+                await asyncio.sleep(wait)
+
+
+def retry_delay(error, attempt):
+    retry_after = None
+    response = getattr(error, "response", None)
+    if response is not None:
+        retry_after = response.headers.get("retry-after")
+    try:
+        return float(retry_after)
+    except (TypeError, ValueError):
+        return min(60, 2**attempt) + random.random()
+
+
+async def complete_async(messages, limiter, **options):
+    """
+    Sends one chat completion through the limiter, backing off on 429 responses.
+
+    Server errors, timeouts and connection errors are retried with the same backoff,
+    without going through the limiter again.
+    """
+    max_tokens = completion_budget(messages)
+    # The API counts max_tokens against the tokens per minute limit as well
+    tokens = sum(count_tokens(message["content"]) for message in messages) + max_tokens
+    limited = True
+    for attempt in range(MAX_RETRIES):
+        if limited:
+            await limiter.acquire(tokens)
+        try:
+            response = await async_client.chat.completions.create(
+                model=MODEL,
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=0.5,
+                **options,
+            )
+            return response.choices[0].message.content
+        except RateLimitError as e:
+            limited = True
+            delay = retry_delay(e, attempt)
+            print(f"Rate limited, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+        except (InternalServerError, APIConnectionError) as e:
+            # APITimeoutError is an APIConnectionError
+            limited = False
+            delay = retry_delay(e, attempt)
+            print(f"{e.__class__.__name__}, retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+    raise RuntimeError(f"Request still failing after {MAX_RETRIES} attempts")
+
+
+async def translate_text_async(
+    text,
+    target_language,
+    limiter,
+    source_language="Polski",
+):
+    if not is_translatable(text):
         return text
+    if memory is not None:
+        cached = memory.get(text, target_language, source_language)
+        if cached is not None:
+            return cached
+    try:
+        content = await complete_async(
+            text_messages(text, target_language, source_language), limiter
+        )
+        translation = content.strip()
+        print(f"{source_language}: {text.strip()} -{target_language}: {translation}\n")
+        if memory is not None:
+            memory.put(text, translation, target_language, source_language)
+        return translation
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return Untranslated(text)
 
 
-def translate_html_section(section):
-    if isinstance(section, Tag):
-        if section.get("data-translated") == "true":
-            # Skip already translated sections
-            return
+async def translate_batch_async(
+    segments,
+    target_language,
+    limiter,
+    source_language="Polski",
+):
+    translated, segments = split_by_memory(segments, target_language, source_language)
+    if not segments:
+        return translated
 
-        for child in section.contents:
-            translate_html_section(child)
+    fetched = {}
+    try:
+        content = await complete_async(
+            batch_messages(segments, target_language, source_language),
+            limiter,
+            response_format={"type": "json_object"},
+        )
+        fetched = parse_batch_response(content, segments)
+        print(f"Batch of {len(segments)} segments -{target_language}: {len(fetched)} translated")
+    except Exception as e:
+        print(f"An error occurred: {e}")
 
-        section["data-translated"] = "true"  # Mark as translated
-    elif isinstance(section, NavigableString):
-        translated_text = translate_text(str(section))
-        section.replace_with(translated_text)
+    remember(segments, fetched, target_language, source_language)
+    translated.update(fetched)
 
+    missing = [segment_id for segment_id in segments if segment_id not in translated]
+    results = await asyncio.gather(
+        *(
+            translate_text_async(segments[segment_id], target_language, limiter, source_language)
+            for segment_id in missing
+        )
+    )
+    translated.update(zip(missing, results))
+    return translated
 
-def split_and_translate_html(html_content):
-    soup = BeautifulSoup(html_content, "html.parser")
-    sections = soup.find_all(
-        ["div", "h1", "h2", "h3", "h4", "h5", "h6", "p", "ol", "li"]
-    )  # Add more tags as needed
 
-    for section in sections:
-        translate_html_section(section)
+def pack_segments(segments, batch_size, max_tokens=None):
+    """
+    Packs segments into batches by measured size.
 
-    return str(soup)
+    A batch is closed when it holds batch_size segments or when adding the next
+    segment would exceed max_tokens, so small segments share a request and large ones
+    do not overflow the completion budget.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    batches = []
+    current = {}
+    current_tokens = 0
+    for segment_id, text in segments.items():
+        tokens = count_tokens(text) + 8  # key, quotes and separators in the JSON payload
+        if current and (
+            len(current) >= batch_size or current_tokens + tokens > max_tokens
+        ):
+            batches.append(current)
+            current = {}
+            current_tokens = 0
+        current[segment_id] = text
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
 
 
-def remove_data_translated_attribute(soup):
-    for tag in soup.find_all(True, {"data-translated": "true"}):
-        del tag["data-translated"]
+def translate_segments(
+    segments,
+    target_language,
+    source_language="Polski",
+    batch_size=0,
+):
+    if batch_size <= 0:
+        return {
+            segment_id: translate_text(text, target_language, source_language)
+            for segment_id, text in segments.items()
+        }
+    translations = {}
+    for batch in pack_segments(segments, batch_size):
+        translations.update(translate_batch(batch, target_language, source_language))
+    return translations
+
+
+async def translate_segments_async(
+    segments,
+    target_language,
+    source_language="Polski",
+    batch_size=0,
+    concurrency=MAX_CONCURRENCY,
+    limiter=None,
+):
+    """
+    Translates {segment_id: text} concurrently and returns {segment_id: translation}.
+
+    With batch_size > 0 the segments are packed into batch requests, otherwise each
+    segment is its own request. At most `concurrency` requests are in flight and all
+    of them go through the shared rate limiter.
+    """
+    limiter = limiter or RateLimiter()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(batch):
+        async with semaphore:
+            if batch_size > 0:
+                return await translate_batch_async(
+                    batch, target_language, limiter, source_language
+                )
+            ((segment_id, text),) = batch.items()
+            translation = await translate_text_async(
+                text, target_language, limiter, source_language
+            )
+            return {segment_id: translation}
+
+    if batch_size > 0:
+        batches = pack_segments(segments, batch_size)
+    else:
+        batches = [{segment_id: text} for segment_id, text in segments.items()]
+    results = await asyncio.gather(*(run(batch) for batch in batches))
+    translated = {}
+    for result in results:
+        translated.update(result)
+    return translated
+
+
+def keep_surrounding_whitespace(original, translation):
+    leading = original[: len(original) - len(original.lstrip())]
+    trailing = original[len(original.rstrip()) :]
+    return leading + translation + trailing
+
+
+def is_inline(node):
+    if isinstance(node, Tag):
+        return node.name in INLINE_TAGS and all(
+            is_inline(child) for child in node.contents
+        )
+    return type(node) is NavigableString
+
+
+def split_tag(tag):
+    """Returns the start and end tag markup BeautifulSoup would write for `tag`."""
+    empty = copy.copy(tag)
+    empty.clear()
+    markup = str(empty)
+    if tag.is_empty_element:
+        return markup, ""
+    end = markup.rindex("</")
+    return markup[:end], markup[end:]
+
+
+def encode_run(run):
+    """
+    Turns a run of sibling nodes into the text sent for translation.
+
+    Inline tags are replaced by numbered placeholders (<g0>...</g0>, <x1/> for void
+    tags) so the model only sees the text and the positions of the tags. Returns the
+    source text and the original start/end tags per placeholder, or None when the run
+    is plain text.
+    """
+    tags = []
+    parts = []  # (text, is_placeholder)
+    stack = list(reversed(run))
+    while stack:
+        node = stack.pop()
+        if isinstance(node, Tag):
+            number = len(tags)
+            tags.append(split_tag(node))
+            if node.is_empty_element:
+                parts.append((f"<x{number}/>", True))
+            else:
+                parts.append((f"<g{number}>", True))
+                stack.append((f"</g{number}>", True))
+                stack.extend(reversed(node.contents))
+        elif isinstance(node, tuple):
+            parts.append(node)  # closing placeholder pushed above
+        else:
+            parts.append((str(node), False))
+    if not tags:
+        return "".join(text for text, _ in parts), None
+    # Text is escaped like BeautifulSoup writes it, so the placeholders are the only tags
+    source = "".join(
+        text if is_placeholder else html.escape(text, quote=False)
+        for text, is_placeholder in parts
+    )
+    return source, tags
+
+
+def collect_runs(soup):
+    """
+    Returns the runs of sibling nodes to translate, in document order.
+
+    A run is a sequence of text nodes and inline tags (b, a, span...) inside a
+    translatable section, so a sentence split by markup is translated as one segment.
+    The tree is walked once with an explicit stack.
+    """
+    runs = []
+
+    def close(run):
+        if any(is_translatable(text) for node in run for text in strings_of(node)):
+            runs.append(list(run))
+        run.clear()
+
+    stack = [(iter(soup.contents), False, [])]
+    while stack:
+        children, in_section, run = stack[-1]
+        child = next(children, None)
+        if child is None:
+            close(run)
+            stack.pop()
+        elif in_section and is_inline(child):
+            run.append(child)
+        else:
+            close(run)
+            if isinstance(child, Tag):
+                stack.append(
+                    (
+                        iter(child.contents),
+                        in_section or child.name in TRANSLATABLE_TAGS,
+                        [],
+                    )
+                )
+    return runs
+
+
+def strings_of(node):
+    if isinstance(node, Tag):
+        return node.strings
+    return [node]
+
+
+def prepare_template(html_content, parser=PARSER):
+    """
+    Parses the document once and turns it into a reusable template.
+
+    Every run of translatable content is replaced by a numbered marker and the
+    serialized document is split on those markers, so rendering a language is a
+    string join instead of another parse and traversal.
+
+    Args:
+    html_content (str): Source HTML.
+    parser (str): BeautifulSoup parser, "html.parser" or "lxml".
+
+    Returns:
+    tuple: Template parts (text and segment numbers alternating), {segment_id: text}
+    and {segment_id: placeholder tags} for segments that contain inline markup.
+    """
+    soup = BeautifulSoup(html_content, parser)
+    segments = {}
+    tags = {}
+    # Segment IDs are document positions, so translations map back to the same markers
+    for index, run in enumerate(collect_runs(soup)):
+        source, run_tags = encode_run(run)
+        segments[f"s{index}"] = source.strip()
+        if run_tags:
+            tags[f"s{index}"] = run_tags
+        marker = NavigableString(
+            keep_surrounding_whitespace(source, SEGMENT_MARKER.format(index))
+        )
+        run[0].insert_before(marker)
+        for node in run:
+            node.extract()
+    return SEGMENT_PATTERN.split(str(soup)), segments, tags
+
+
+def placeholders_match(source, translation):
+    expected = sorted(m.group(0) for m in PLACEHOLDER_PATTERN.finditer(source))
+    found = [m.group(0) for m in PLACEHOLDER_PATTERN.finditer(translation)]
+    if sorted(found) != expected:
+        return False
+    open_tags = []
+    for placeholder in found:
+        if placeholder.startswith("</"):
+            if not open_tags or open_tags.pop() != placeholder[2:-1]:
+                return False
+        elif not placeholder.endswith("/>"):
+            open_tags.append(placeholder[1:-1])
+    return True
+
+
+def render_segment(translation, tags):
+    if tags is None:
+        # Escape like BeautifulSoup's default formatter does for text nodes
+        return html.escape(translation, quote=False)
+
+    def restore(match):
+        closing, paired, void = match.groups()
+        if void is not None:
+            return tags[int(void)][0]
+        start_tag, end_tag = tags[int(paired)]
+        return end_tag if closing else start_tag
+
+    return PLACEHOLDER_PATTERN.sub(restore, translation)
+
+
+def render_template(parts, translations, tags):
+    output = []
+    for position, part in enumerate(parts):
+        if position % 2:
+            segment_id = f"s{part}"
+            output.append(render_segment(translations[segment_id], tags.get(segment_id)))
+        else:
+            output.append(part)
+    return "".join(output)
+
+
+def split_sentences(text, max_tokens):
+    """Splits text at sentence ends into pieces of at most max_tokens, never inside a tag pair."""
+    sentences = []
+    start = 0
+    for match in SENTENCE_END.finditer(text):
+        sentences.append(text[start : match.end()])
+        start = match.end()
+    sentences.append(text[start:])
+
+    pieces = []
+    current = ""
+    current_tokens = 0
+    depth = 0
+    for sentence in sentences:
+        tokens = count_tokens(sentence)
+        if current and depth == 0 and current_tokens + tokens > max_tokens:
+            pieces.append(current)
+            current = ""
+            current_tokens = 0
+        current += sentence
+        current_tokens += tokens
+        for match in PLACEHOLDER_PATTERN.finditer(sentence):
+            if match.group(2) is not None:
+                depth += -1 if match.group(1) else 1
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def split_oversized(segments, max_tokens=None):
+    """
+    Splits segments longer than max_tokens at sentence boundaries.
+
+    Returns the segments to translate, with pieces named "<segment_id>.<n>", and the
+    pieces of every split segment so join_pieces can put them back together.
+    """
+    max_tokens = max_tokens or CHUNK_TOKENS
+    pieces = {}
+    groups = {}
+    for segment_id, text in segments.items():
+        if count_tokens(text) <= max_tokens:
+            pieces[segment_id] = text
+            continue
+        groups[segment_id] = []
+        for number, piece in enumerate(split_sentences(text, max_tokens)):
+            piece_id = f"{segment_id}.{number}"
+            pieces[piece_id] = piece.strip()
+            groups[segment_id].append((piece_id, piece))
+    return pieces, groups
+
+
+def join_pieces(translations, groups):
+    for segment_id, pieces in groups.items():
+        parts = [(piece, translations.pop(piece_id)) for piece_id, piece in pieces]
+        joined = "".join(
+            keep_surrounding_whitespace(piece, translation)
+            for piece, translation in parts
+        ).strip()
+        if any(isinstance(translation, Untranslated) for _, translation in parts):
+            joined = Untranslated(joined)
+        translations[segment_id] = joined
+    return translations
+
+
+def repair_translations(
+    segments, translations, tags, target_language, source_language="Polski"
+):
+    """
+    Re-translates segments whose placeholders were lost or reordered by the model.
+
+    The text between placeholders is translated piece by piece, which keeps the
+    markup intact at the cost of some context.
+    """
+    for segment_id in tags:
+        source = segments[segment_id]
+        if placeholders_match(source, translations[segment_id]):
+            continue
+        print(f"Placeholders changed in {segment_id}, translating its text separately")
+        output = []
+        failed = False
+        for part in PLACEHOLDER_SPLIT.split(source):
+            if PLACEHOLDER_PATTERN.fullmatch(part) or not is_translatable(part):
+                output.append(part)
+                continue
+            translation = translate_text(
+                html.unescape(part).strip(), target_language, source_language
+            )
+            failed = failed or isinstance(translation, Untranslated)
+            output.append(
+                keep_surrounding_whitespace(part, html.escape(translation, quote=False))
+            )
+        translations[segment_id] = (
+            Untranslated("".join(output)) if failed else "".join(output)
+        )
+    return translations
+
+
+def translate_to_languages(
+    html_content,
+    target_languages,
+    source_language="Polski",
+    batch_size=0,
+    concurrency=MAX_CONCURRENCY,
+    limiter=None,
+    parser=PARSER,
+):
+    """
+    Translates one document into several languages from a single prepared template.
+
+    All languages are translated in parallel and share one rate limiter; `concurrency`
+    applies to each language separately.
+
+    Returns:
+    dict: Target language to translated HTML.
+    """
+    parts, segments, tags = prepare_template(html_content, parser)
+    pieces, groups = split_oversized(segments)
+    limiter = limiter or RateLimiter()
+
+    async def fan_out():
+        return await asyncio.gather(
+            *(
+                translate_segments_async(
+                    pieces,
+                    language,
+                    source_language,
+                    batch_size,
+                    concurrency,
+                    limiter,
+                )
+                for language in target_languages
+            )
+        )
+
+    results = asyncio.run(fan_out())
+    output = {}
+    for language, translations in zip(target_languages, results):
+        translations = join_pieces(translations, groups)
+        translations = repair_translations(
+            segments, translations, tags, language, source_language
+        )
+        output[language] = render_template(parts, translations, tags)
+    return output
+
+
+def split_and_translate_html(
+    html_content,
+    target_language,
+    batch_size=0,
+    concurrency=0,
+    limiter=None,
+    parser=PARSER,
+):
+    parts, segments, tags = prepare_template(html_content, parser)
+    pieces, groups = split_oversized(segments)
+
+    if concurrency > 0:
+        translations = asyncio.run(
+            translate_segments_async(
+                pieces,
+                target_language,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                limiter=limiter,
+            )
+        )
+    else:
+        translations = translate_segments(
+            pieces, target_language, batch_size=batch_size
+        )
+
+    translations = join_pieces(translations, groups)
+    translations = repair_translations(segments, translations, tags, target_language)
+    return render_template(parts, translations, tags)
+
+
+def list_html_files(source_dir):
+    for root, _, files in os.walk(source_dir):
+        for name in files:
+            if name.lower().endswith((".html", ".htm")):
+                yield os.path.relpath(os.path.join(root, name), source_dir)
+
+
+def segment_hash(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_manifest(path, manifest):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(manifest, file, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+def prepare_file(path, parser, known_hash):
+    """
+    Process pool worker: hashes a source file and prepares its template.
+
+    Parsing is skipped when the hash equals known_hash, i.e. every language is
+    already translated from this exact content. Returns the hash, the template and
+    the error message if the file could not be read or parsed.
+    """
+    try:
+        with open(path, "rb") as file:
+            data = file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest == known_hash:
+            return digest, None, None
+        return digest, prepare_template(data.decode("utf-8"), parser), None
+    except Exception as e:
+        return None, None, f"{e.__class__.__name__}: {e}"
+
+
+def translate_documents(
+    documents,
+    output_dir,
+    target_language,
+    manifest,
+    source_language="Polski",
+    batch_size=BATCH_SIZE,
+    concurrency=0,
+    limiter=None,
+):
+    """
+    Translates prepared documents into one language and records them in the manifest.
+
+    Segments whose source is unchanged since the file's previous translation are taken
+    from the manifest, the rest of all documents is deduplicated and translated
+    together so batches span files. Documents with a failed segment are neither
+    written nor recorded, so the next run translates them again.
+    """
+    requests = {}
+    request_ids = {}
+    reused = {}
+    queued = []
+    for relpath, (digest, (parts, segments, tags)) in documents.items():
+        output_path = os.path.join(output_dir, relpath)
+        entry = manifest.get(relpath, {})
+        if entry.get("hash") == digest and os.path.exists(output_path):
+            continue
+        previous = entry.get("segments", {})
+        for segment_id, text in segments.items():
+            cached = previous.get(segment_hash(text))
+            if cached is not None:
+                reused[relpath, segment_id] = cached
+            elif text not in request_ids:
+                request_ids[text] = f"r{len(requests)}"
+                requests[request_ids[text]] = text
+        queued.append(relpath)
+
+    pieces, groups = split_oversized(requests)
+    if concurrency > 0:
+        translations = asyncio.run(
+            translate_segments_async(
+                pieces,
+                target_language,
+                source_language,
+                batch_size,
+                concurrency,
+                limiter,
+            )
+        )
+    else:
+        translations = translate_segments(
+            pieces, target_language, source_language, batch_size
+        )
+    translations = join_pieces(translations, groups)
+
+    written = 0
+    for relpath in queued:
+        digest, (parts, segments, tags) = documents[relpath]
+        document_translations = {}
+        for segment_id, text in segments.items():
+            if (relpath, segment_id) in reused:
+                document_translations[segment_id] = reused[relpath, segment_id]
+            else:
+                document_translations[segment_id] = translations[request_ids[text]]
+        document_translations = repair_translations(
+            segments, document_translations, tags, target_language, source_language
+        )
+        if any(
+            isinstance(translation, Untranslated)
+            for translation in document_translations.values()
+        ):
+            print(f"{relpath}: some segments failed to translate, left for the next run")
+            continue
+        output_path = os.path.join(output_dir, relpath)
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        with open(output_path, "w", encoding="utf-8") as file:
+            file.write(render_template(parts, document_translations, tags))
+        manifest[relpath] = {
+            "hash": digest,
+            "segments": {
+                segment_hash(segments[segment_id]): translation
+                for segment_id, translation in document_translations.items()
+            },
+        }
+        written += 1
+    return written, len(reused), len(requests)
+
+
+def translate_directory(
+    source_dir,
+    output_dir,
+    target_languages,
+    source_language="Polski",
+    batch_size=BATCH_SIZE,
+    concurrency=0,
+    limiter=None,
+    parser=PARSER,
+    workers=None,
+):
+    """
+    Translates every HTML file under source_dir into output_dir/<language>/.
+
+    A manifest per language stores the hash of each translated source file and its
+    segment translations. Files whose hash has not changed are skipped without being
+    parsed, and in changed files only new or modified segments are sent to the API.
+    Files are parsed in a process pool and handled in rounds of DIRECTORY_ROUND files,
+    with the manifests saved after each round, so an interrupted run resumes.
+    """
+    manifest_paths = {
+        language: os.path.join(output_dir, language, MANIFEST_NAME)
+        for language in target_languages
+    }
+    manifests = {
+        language: load_manifest(path) for language, path in manifest_paths.items()
+    }
+    relpaths = sorted(list_html_files(source_dir))
+    limiter = limiter or RateLimiter()
+
+    def known_hash(relpath):
+        hashes = set()
+        for language in target_languages:
+            if not os.path.exists(os.path.join(output_dir, language, relpath)):
+                return None
+            hashes.add(manifests[language].get(relpath, {}).get("hash"))
+        return hashes.pop() if len(hashes) == 1 else None
+
+    unchanged = 0
+    failed = 0
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(relpaths), DIRECTORY_ROUND):
+            round_paths = relpaths[start : start + DIRECTORY_ROUND]
+            prepared = pool.map(
+                prepare_file,
+                [os.path.join(source_dir, relpath) for relpath in round_paths],
+                [parser] * len(round_paths),
+                [known_hash(relpath) for relpath in round_paths],
+                chunksize=8,
+            )
+            documents = {}
+            for relpath, (digest, template, error) in zip(round_paths, prepared):
+                if error:
+                    # Left out of the manifests, so it is tried again on the next run
+                    failed += 1
+                    print(f"Skipping {relpath}: {error}")
+                elif template is None:
+                    unchanged += 1
+                else:
+                    documents[relpath] = (digest, template)
+
+            for language in target_languages:
+                files, reused, requested = translate_documents(
+                    documents,
+                    os.path.join(output_dir, language),
+                    language,
+                    manifests[language],
+                    source_language,
+                    batch_size,
+                    concurrency,
+                    limiter,
+                )
+                save_manifest(manifest_paths[language], manifests[language])
+                print(
+                    f"{language}: {files} files translated, {reused} segments reused, {requested} segments requested"
+                )
+            print(f"Processed {start + len(round_paths)}/{len(relpaths)} files")
+
+    # Forget files that no longer exist in the source directory
+    existing = set(relpaths)
+    for language, manifest in manifests.items():
+        for relpath in [path for path in manifest if path not in existing]:
+            del manifest[relpath]
+        save_manifest(manifest_paths[language], manifest)
+    print(f"{unchanged} unchanged files skipped, {failed} files could not be read")
 
 
 def save_html_to_file(html_content, language):
@@ -83,8 +1152,121 @@ html_content = """
 TEXT TO TRANSLATE
 """
 
-translated_html = split_and_translate_html(html_content)
-soup = BeautifulSoup(translated_html, "html.parser")
-remove_data_translated_attribute(soup)
-final_html = str(soup)
-save_html_to_file(final_html, "OUTPUT_LANG")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Translate HTML content with OpenAI")
+    parser.add_argument(
+        "languages",
+        type=str,
+        default=["OUTPUT_LANG"],
+        nargs="*",
+        help="Target languages, several languages share one parse of the document",
+    )
+    parser.add_argument(
+        "--input", type=str, help="HTML file to translate instead of html_content"
+    )
+    parser.add_argument(
+        "--input-dir", type=str, help="Translate every HTML file in this directory"
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="translated",
+        help="Output root for --input-dir, one subdirectory per language",
+    )
+    parser.add_argument(
+        "--workers", type=int, help="Parsing processes for --input-dir (default: CPU count)"
+    )
+    parser.add_argument(
+        "--parser",
+        choices=["html.parser", "lxml"],
+        default=PARSER,
+        help="HTML parser, lxml wraps fragments in <html><body>",
+    )
+    parser.add_argument(
+        "--memory",
+        type=str,
+        default=MEMORY_PATH,
+        help="SQLite translation memory file",
+    )
+    parser.add_argument(
+        "--no-memory", action="store_true", help="Do not use the translation memory"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=0,
+        help=f"Segments sent per request, e.g. {BATCH_SIZE} (0 sends one request per segment)",
+    )
+    parser.add_argument(
+        "--chunk-tokens",
+        type=int,
+        default=CHUNK_TOKENS,
+        help="Source tokens per request, longer segments are split at sentence ends",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=0,
+        help=f"Translate concurrently with the async client, e.g. {MAX_CONCURRENCY} requests in flight",
+    )
+    parser.add_argument(
+        "--rpm", type=int, default=REQUESTS_PER_MINUTE, help="Requests per minute limit"
+    )
+    parser.add_argument(
+        "--tpm", type=int, default=TOKENS_PER_MINUTE, help="Tokens per minute limit"
+    )
+    args = parser.parse_args()
+
+    CHUNK_TOKENS = args.chunk_tokens
+    if not args.no_memory:
+        memory = TranslationMemory(args.memory)
+
+    if args.input:
+        with open(args.input, "r", encoding="utf-8") as file:
+            html_content = file.read()
+
+    if args.parser == "lxml":
+        try:
+            BeautifulSoup("", "lxml")
+        except FeatureNotFound:
+            print("lxml is not installed, falling back to html.parser")
+            args.parser = "html.parser"
+
+    limiter = RateLimiter(args.rpm, args.tpm)
+    if args.input_dir:
+        translate_directory(
+            args.input_dir,
+            args.output_dir,
+            args.languages,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency,
+            limiter=limiter,
+            parser=args.parser,
+            workers=args.workers,
+        )
+    elif len(args.languages) > 1:
+        results = translate_to_languages(
+            html_content,
+            args.languages,
+            batch_size=args.batch_size,
+            concurrency=args.concurrency or MAX_CONCURRENCY,
+            limiter=limiter,
+            parser=args.parser,
+        )
+        for language, final_html in results.items():
+            save_html_to_file(final_html, language)
+    else:
+        (language,) = args.languages
+        final_html = split_and_translate_html(
+            html_content,
+            language,
+            args.batch_size,
+            args.concurrency,
+            limiter,
+            args.parser,
+        )
+        save_html_to_file(final_html, language)
+
+    if memory is not None:
+        print(memory.stats())
+        memory.close()
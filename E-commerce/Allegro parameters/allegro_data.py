@@ -1,13 +1,16 @@
 from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import requests
 import logging
+import threading
 
 # Setup your logging
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-MAX_ROWS_TO_PROCESS = 100
+MAX_ROWS_TO_PROCESS = None  # None processes every row, reruns resume from the journal
 PRODUCT_ID_COLUMN = "L"  # "product ID"
 EAN_COLUMN = "AJ"
 MINIATURE_COLUMN = "AK"
@@ -16,7 +19,11 @@ PHOTO_COLUMN_2 = "AM"
 PHOTO_COLUMN_3 = "AN"
 LENGTH_OF_INSOLE = "AO"
 CODE_COLUMN = "AP"
-STARTING_ROW = 439
+STARTING_ROW = 5
+PRODUCTS_PER_REQUEST = 100
+WORKERS = 4  # requests in flight at the same time
+SAVE_EVERY = 500  # rows written to the sheet between workbook saves
+JOURNAL_SUFFIX = ".data.journal"  # next to the workbook, lists finished rows
 API_TIMEOUT = 20  # seconds
 API_URL = "https://xxx.pl/api/admin/v3/products/products/get"
 API_CODE = "https://xxx.pl/api/admin/v3/products/products?productIds="
@@ -26,29 +33,60 @@ API_HEADERS = {
     "X-API-KEY": "xxx",
 }
 
+# Shared keep-alive connections, one per worker, instead of a new TLS handshake per call
+session = requests.Session()
+session.headers.update(API_HEADERS)
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS))
 
-def get_sku(product_id):
-    try:
-        response = requests.get(
-            f"{API_SIZE_URL}{product_id}", headers=API_HEADERS, timeout=API_TIMEOUT
+
+http_calls = 0
+http_calls_lock = threading.Lock()
+
+
+def count_http_call():
+    global http_calls
+    with http_calls_lock:
+        http_calls += 1
+
+
+def results_by_product(json_response):
+    """Groups API results by product, as {"results": [...]} responses of a single product."""
+    responses = {}
+    for result in json_response.get("results") or []:
+        product_index = result.get("productIndex", result.get("productId"))
+        if product_index is None:
+            logging.error(f"Result without a product ID skipped: {result}")
+            continue
+        responses.setdefault(str(product_index), {"results": []})["results"].append(
+            result
         )
+    return responses
+
+
+def get_sku(product_ids):
+    count_http_call()
+    ids = ",".join(str(product_id) for product_id in product_ids)
+    try:
+        response = session.get(f"{API_SIZE_URL}{ids}", timeout=API_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return results_by_product(response.json())
     except requests.RequestException as e:
-        logging.error(f"API request error for ID {product_id}: {e}")
+        logging.error(f"API request error for IDs {ids}: {e}")
         return None
 
-def get_product_displayed_code(product_id):
+
+def get_product_displayed_code(product_ids):
+    count_http_call()
+    ids = ",".join(str(product_id) for product_id in product_ids)
     try:
-        response = requests.get(
-            f"{API_CODE}{product_id}", headers=API_HEADERS, timeout=API_TIMEOUT
-        )
+        response = session.get(f"{API_CODE}{ids}", timeout=API_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return results_by_product(response.json())
     except requests.RequestException as e:
-        logging.error(f"API request error for ID {product_id}: {e}")
+        logging.error(f"API request error for IDs {ids}: {e}")
         return None
 
+
 def get_value_for_size(size, size_chart):
     size_pairs = size_chart.split("/")
     for pair in size_pairs:
@@ -77,8 +115,8 @@ def extract_code(response):
         code = result.get("productDisplayedCode")
     return code
 
-def process_size_chart(product_id, size_chart):
-    size_response = get_sku(product_id)
+def process_size_chart(size_response, size_chart):
+    size_name = ""
     if size_response is not None:
         size_name = extract_size_names(size_response)
     else:
@@ -87,8 +125,8 @@ def process_size_chart(product_id, size_chart):
     size_value = get_value_for_size(size_name, size_chart)
     return size_value
 
-def process_ean(product_id):
-    ean_response = get_sku(product_id)
+def process_ean(ean_response):
+    ean = ""
     if ean_response is not None:
         ean = extract_ean(ean_response)
     else:
@@ -96,8 +134,8 @@ def process_ean(product_id):
 
     return ean
 
-def process_displayed_code(product_id):
-    code_response = get_product_displayed_code(product_id)
+def process_displayed_code(code_response):
+    code = ""
     if code_response is not None:
         code = extract_code(code_response)
     else:
@@ -105,43 +143,82 @@ def process_displayed_code(product_id):
 
     return code
 
-def get_product_parameters(product_id):
+def get_product_parameters(product_ids):
+    count_http_call()
     request_data = {
         "params": {
             "returnElements": ["sizeschart_name", "icon_for_auctions", "pictures"],
-            "productIndexes": [{"productIndex": product_id}],
+            "productIndexes": [
+                {"productIndex": product_id} for product_id in product_ids
+            ],
         }
     }
     try:
-        response = requests.post(
-            API_URL, json=request_data, headers=API_HEADERS, timeout=API_TIMEOUT
-        )
+        response = session.post(API_URL, json=request_data, timeout=API_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        return results_by_product(response.json())
     except requests.RequestException as e:
-        logging.error(f"API request error for ID {product_id}: {e}")
+        logging.error(f"API request error for IDs {product_ids}: {e}")
         return None
 
-def update_parameters_in_sheet(sheet, product_id, row):
-    json_response = get_product_parameters(product_id)
+def fetch_products(product_ids):
+    """
+    Fetches everything the sheet needs for the given products, each endpoint once.
+
+    The product data, SKU and displayed code endpoints all accept lists, so each is
+    called once per chunk of PRODUCTS_PER_REQUEST products instead of once (or, for
+    the SKU, twice) per row.
+
+    Args:
+    product_ids (list): At most PRODUCTS_PER_REQUEST distinct product IDs.
+
+    Returns:
+    dict: Product ID (as str) -> {"info", "sku", "code"} responses, None where missing,
+    and "failed", True when any of the requests failed.
+    """
+    infos = get_product_parameters(product_ids)
+    skus = get_sku(product_ids)
+    codes = get_product_displayed_code(product_ids)
+    failed = infos is None or skus is None or codes is None
+    return {
+        product_id: {
+            "info": (infos or {}).get(product_id),
+            "sku": (skus or {}).get(product_id),
+            "code": (codes or {}).get(product_id),
+            "failed": failed,
+        }
+        for product_id in map(str, product_ids)
+    }
+
+def update_parameters_in_sheet(sheet, product_id, row, product):
+    if product["failed"]:
+        # Nothing is written, so the row is not journaled and the next run retries it
+        logging.error(f"API request failed for ID {product_id}, row {row} left for the next run")
+        return False
+
+    json_response = product["info"]
     if (
         not json_response
         or "results" not in json_response
         or not json_response["results"]
     ):
         logging.error(f"No results found for ID {product_id}")
-        return
+        return False
+    if product["sku"] is None or product["code"] is None:
+        # Written without them the row would get blank cells and never be retried
+        logging.error(f"No SKU or displayed code found for ID {product_id}")
+        return False
 
     product_info = json_response["results"][0]
 
-    ean_value = process_ean(product_id)
+    ean_value = process_ean(product["sku"])
     sheet[f"{EAN_COLUMN}{row}"].value = ean_value
 
-    code_value = process_displayed_code(product_id)
+    code_value = process_displayed_code(product["code"])
     sheet[f"{CODE_COLUMN}{row}"].value = code_value
 
     size_chart = product_info.get("sizeChartName", "")
-    size_value = process_size_chart(product_id, size_chart)
+    size_value = process_size_chart(product["sku"], size_chart)
     sheet[f"{LENGTH_OF_INSOLE}{row}"].value = size_value
 
     auction_icon_url = product_info.get("productAuctionIcon", {}).get(
@@ -181,29 +258,110 @@ def update_parameters_in_sheet(sheet, product_id, row):
 
 
     logging.info(f"Updated parameters for product ID {product_id} in row {row}")
+    return True
+
+def plan_chunks(rows):
+    """
+    Splits the rows into chunks of at most PRODUCTS_PER_REQUEST new product IDs.
+
+    Every product is requested in exactly one chunk. Each chunk carries the rows
+    that follow it in the sheet, and those rows only need products from that chunk
+    or earlier ones. So once the chunks finish in order, their rows can be written
+    in row order.
+
+    Args:
+    rows (list): (row, product_id) tuples in sheet order.
+
+    Returns:
+    list: (product_ids, rows) tuples.
+    """
+    chunks = []
+    seen = set()
+    product_ids, chunk_rows = [], []
+    for row, product_id in rows:
+        if str(product_id) not in seen:
+            if len(product_ids) == PRODUCTS_PER_REQUEST:
+                chunks.append((product_ids, chunk_rows))
+                product_ids, chunk_rows = [], []
+            seen.add(str(product_id))
+            product_ids.append(product_id)
+        chunk_rows.append((row, product_id))
+    if chunk_rows:
+        chunks.append((product_ids, chunk_rows))
+    return chunks
+
+def load_journal(journal_path):
+    """Returns the (row, product ID) pairs that are already saved in the workbook."""
+    done = set()
+    try:
+        with open(journal_path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                row, _, product_id = line.rstrip("\n").partition("\t")
+                done.add((int(row), product_id))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def save_progress(wb, file_path, journal_path, written_rows):
+    """Saves the workbook, then records the rows written since the last save."""
+    if not written_rows:
+        return
+    wb.save(file_path)
+    with open(journal_path, "a", encoding="utf-8") as journal:
+        for row, product_id in written_rows:
+            journal.write(f"{row}\t{product_id}\n")
+    logging.info(f"Workbook saved with {len(written_rows)} more rows: {file_path}")
+    written_rows.clear()
 
 def process_workbook(file_path):
+    # Rows saved by an earlier run are skipped, unless their product ID changed
+    journal_path = file_path + JOURNAL_SUFFIX
+    done = load_journal(journal_path)
+    written_rows = []
     try:
         wb = load_workbook(file_path, keep_vba=True)
         sheet = wb.active
 
-        processed_rows = 0
-
+        rows = []
         for row in range(STARTING_ROW, sheet.max_row + 1):
-            if processed_rows >= MAX_ROWS_TO_PROCESS:
-               break
+            if MAX_ROWS_TO_PROCESS and len(rows) >= MAX_ROWS_TO_PROCESS:
+                break
             product_id = sheet[f"{PRODUCT_ID_COLUMN}{row}"].value
-            if product_id:
-                logging.info(f"Updating parameters for ID {product_id} in row {row}")
-                update_parameters_in_sheet(sheet, product_id, row)
-                processed_rows += 1
+            if product_id and (row, str(product_id)) not in done:
+                rows.append((row, product_id))
+        logging.info(
+            f"{len(rows)} rows to process, {len(done)} already done according to {journal_path}"
+        )
+
+        # Chunks are fetched by WORKERS threads, cells are written here in row order
+        chunks = plan_chunks(rows)
+        products = {}
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            fetched = executor.map(
+                fetch_products, [product_ids for product_ids, _ in chunks]
+            )
+            for (_, chunk_rows), chunk_products in zip(chunks, fetched):
+                products.update(chunk_products)
+                for row, product_id in chunk_rows:
+                    logging.info(f"Updating parameters for ID {product_id} in row {row}")
+                    if update_parameters_in_sheet(
+                        sheet, product_id, row, products[str(product_id)]
+                    ):
+                        written_rows.append((row, product_id))
+                if len(written_rows) >= SAVE_EVERY:
+                    save_progress(wb, file_path, journal_path, written_rows)
 
-        wb.save(file_path)
+        if rows:
+            # Previously products/get, 2x SKUbyBarcode and products per row
+            logging.info(
+                f"{http_calls} HTTP calls for {len(rows)} rows: {http_calls / len(rows):.2f} per row (previously 4)"
+            )
+        save_progress(wb, file_path, journal_path, written_rows)
         logging.info(f"Workbook processed and saved: {file_path}")
     except Exception as e:
         logging.error(f"Error occurred, saving progress and stopping script: {e}")
-        wb.save(file_path)
-        logging.info(f"Workbook saved: {file_path}")
+        save_progress(wb, file_path, journal_path, written_rows)
         raise  # Reraise the exception to stop the script
 
 
@@ -1,11 +1,78 @@
 from openpyxl import load_workbook
+from bisect import bisect_left
 import logging
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+KEY_COLUMN_1 = 10  # "J", product IDs in the first file
+KEY_COLUMN_2 = 12  # "L", product IDs in the second file
+
+
+def collect_keys(sheet, column, start_row):
+    """Returns the set of non-empty values in the column, from start_row down."""
+    return {
+        value
+        for (value,) in sheet.iter_rows(
+            min_row=start_row, min_col=column, max_col=column, values_only=True
+        )
+        if value is not None
+    }
+
+
+def find_rows_to_delete(sheet, column, keys):
+    """Returns the numbers of the rows whose value in the column is one of the keys."""
+    return [
+        row
+        for row, (value,) in enumerate(
+            sheet.iter_rows(min_col=column, max_col=column, values_only=True), start=1
+        )
+        if value in keys
+    ]
+
+
+def compact_rows(sheet, rows_to_delete):
+    """
+    Deletes the given rows by moving every kept row up in a single pass.
+
+    delete_rows shifts all cells below the deleted row, so deleting rows one by one
+    is quadratic. Here every cell is moved at most once. Cell objects are moved as
+    they are, so values and styles stay intact. Formulas are kept unchanged, as
+    delete_rows keeps them.
+
+    Args:
+    sheet (Worksheet): Sheet to compact in place.
+    rows_to_delete (iterable): Row numbers to delete.
+    """
+    deleted_rows = set(rows_to_delete)
+    if not deleted_rows:
+        return
+    deleted = sorted(deleted_rows)
+    # openpyxl keeps the cells in sheet._cells, keyed by (row, column)
+    cells_by_row = {}
+    for row, column in list(sheet._cells):
+        if row in deleted_rows:
+            del sheet._cells[row, column]
+        elif row > deleted[0]:
+            cells_by_row.setdefault(row, []).append(column)
+
+    # Top to bottom, so the cells above have already moved out of the way
+    for row in sorted(cells_by_row):
+        offset = bisect_left(deleted, row)
+        for column in cells_by_row[row]:
+            sheet._move_cell(row, column, -offset, 0)
+
+    # Row heights and hidden rows move with their rows
+    dimensions = sheet.row_dimensions
+    moved = {row: dimensions.pop(row) for row in list(dimensions) if row >= deleted[0]}
+    for row, dimension in moved.items():
+        if row not in deleted_rows:
+            dimension.index = row - bisect_left(deleted, row)
+            dimensions[dimension.index] = dimension
+
+
 def remove_matching_rows(file1_path, file2_path, start_row=5):
     logging.info("Starting process...")
-    wb1 = load_workbook(file1_path)
+    wb1 = load_workbook(file1_path, read_only=True)
     sheet1 = wb1.active
     logging.info(f"{file1_path} loaded successfully.")
 
@@ -13,26 +80,21 @@ def remove_matching_rows(file1_path, file2_path, start_row=5):
     sheet2 = wb2.active
     logging.info(f"{file2_path} loaded successfully.")
 
-    values_to_check = [sheet1[f"J{row}"].value for row in range(start_row, sheet1.max_row + 1) if sheet1[f"J{row}"].value is not None]
-    logging.info("Values collected from the first file.")
+    values_to_check = collect_keys(sheet1, KEY_COLUMN_1, start_row)
+    wb1.close()
+    logging.info(f"{len(values_to_check)} values collected from the first file.")
 
-    rows_to_delete = []
-
-    for row in range(1, sheet2.max_row + 1):
-        cell_value = sheet2[f"L{row}"].value
-        if cell_value in values_to_check:
-            rows_to_delete.append(row)
+    rows_to_delete = find_rows_to_delete(sheet2, KEY_COLUMN_2, values_to_check)
     logging.info(f"Found {len(rows_to_delete)} rows to delete.")
 
-    rows_to_delete.sort(reverse=True)
-
-    for row in rows_to_delete:
-        sheet2.delete_rows(row)
-        logging.info(f"Deleted row: {row}")
+    compact_rows(sheet2, rows_to_delete)
+    logging.info(f"Deleted {len(rows_to_delete)} rows.")
 
     wb2.save(file2_path)
     logging.info(f"Rows removed and {file2_path} saved.")
 
-file1_path = "xxx.xlsm"
-file2_path = "xxx2.xlsm"
-remove_matching_rows(file1_path, file2_path)
\ No newline at end of file
+
+if __name__ == "__main__":
+    file1_path = "xxx.xlsm"
+    file2_path = "xxx2.xlsm"
+    remove_matching_rows(file1_path, file2_path)
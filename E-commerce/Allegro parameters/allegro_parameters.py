@@ -1,4 +1,6 @@
 from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 import requests
 import logging
 
@@ -6,7 +8,7 @@ logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-MAX_ROWS_TO_PROCESS = 100
+MAX_ROWS_TO_PROCESS = None  # None processes every row, reruns resume from the journal
 PRODUCT_ID_COLUMN = "L"  # "Product ID"
 PARAMETER_COLUMNS = {
     18: "CB",  # "Kolor"
@@ -30,6 +32,10 @@ PARAMETER_COLUMNS = {
     4286: "CT",  # "Wysokość obcasa/platformy"
 }
 STARTING_ROW = 5
+PRODUCTS_PER_REQUEST = 100
+WORKERS = 4  # requests in flight at the same time
+SAVE_EVERY = 500  # rows written to the sheet between workbook saves
+JOURNAL_SUFFIX = ".parameters.journal"  # next to the workbook, lists finished rows
 API_TIMEOUT = 10  # seconds
 API_URL = "https://xxx.pl/api/admin/v3/products/products/get"
 API_HEADERS = {
@@ -37,36 +43,51 @@ API_HEADERS = {
     "X-API-KEY": "xxx",
 }
 
+# Shared keep-alive connections, one per worker, instead of a new TLS handshake per call
+session = requests.Session()
+session.headers.update(API_HEADERS)
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=WORKERS))
 
-def get_product_parameters(product_id):
+
+def get_products_parameters(product_ids):
+    """
+    Fetches the parameters of several products with a single products/get request.
+
+    Args:
+    product_ids (list): Product indexes, at most PRODUCTS_PER_REQUEST.
+
+    Returns:
+    dict: Product index (as str) -> result, empty if the request failed.
+    """
     request_data = {
         "params": {
             "returnElements": ["parameters"],
-            "productIndexes": [{"productIndex": product_id}],
+            "productIndexes": [
+                {"productIndex": product_id} for product_id in product_ids
+            ],
         }
     }
     try:
-        response = requests.post(
-            API_URL, json=request_data, headers=API_HEADERS, timeout=API_TIMEOUT
-        )
+        response = session.post(API_URL, json=request_data, timeout=API_TIMEOUT)
         response.raise_for_status()
-        return response.json()
+        json_response = response.json()
     except requests.RequestException as e:
-        logging.error(f"API request error for ID {product_id}: {e}")
-        return None
+        logging.error(f"API request error for IDs {product_ids}: {e}")
+        return {}
+
+    results = {}
+    for result in json_response.get("results") or []:
+        product_index = result.get("productIndex", result.get("productId"))
+        results[str(product_index)] = result
+    return results
 
 
-def update_parameters_in_sheet(sheet, product_id, row):
-    json_response = get_product_parameters(product_id)
-    if (
-        not json_response
-        or "results" not in json_response
-        or not json_response["results"]
-    ):
+def update_parameters_in_sheet(sheet, product_id, row, product_result):
+    if not product_result:
         logging.error(f"No results found for ID {product_id}")
-        return
+        return False
 
-    product_parameters = json_response["results"][0].get("productParameters", [])
+    product_parameters = product_result.get("productParameters", [])
 
     expected_param_ids = set(PARAMETER_COLUMNS.keys())
 
@@ -95,30 +116,108 @@ def update_parameters_in_sheet(sheet, product_id, row):
     for missing_param_id in missing_param_ids:
         column_letter = PARAMETER_COLUMNS[missing_param_id]
         sheet[f"{column_letter}{row}"].value = "BRAK PARAMETRU"
+    return True
+
+
+def plan_chunks(rows):
+    """
+    Splits the rows into chunks of at most PRODUCTS_PER_REQUEST new product IDs.
+
+    Every product is requested in exactly one chunk. Each chunk carries the rows
+    that follow it in the sheet, and those rows only need products from that chunk
+    or earlier ones. So once the chunks finish in order, their rows can be written
+    in row order.
+
+    Args:
+    rows (list): (row, product_id) tuples in sheet order.
+
+    Returns:
+    list: (product_ids, rows) tuples.
+    """
+    chunks = []
+    seen = set()
+    product_ids, chunk_rows = [], []
+    for row, product_id in rows:
+        if str(product_id) not in seen:
+            if len(product_ids) == PRODUCTS_PER_REQUEST:
+                chunks.append((product_ids, chunk_rows))
+                product_ids, chunk_rows = [], []
+            seen.add(str(product_id))
+            product_ids.append(product_id)
+        chunk_rows.append((row, product_id))
+    if chunk_rows:
+        chunks.append((product_ids, chunk_rows))
+    return chunks
+
+
+def load_journal(journal_path):
+    """Returns the (row, product ID) pairs that are already saved in the workbook."""
+    done = set()
+    try:
+        with open(journal_path, "r", encoding="utf-8") as journal:
+            for line in journal:
+                row, _, product_id = line.rstrip("\n").partition("\t")
+                done.add((int(row), product_id))
+    except FileNotFoundError:
+        pass
+    return done
+
+
+def save_progress(wb, file_path, journal_path, written_rows):
+    """Saves the workbook, then records the rows written since the last save."""
+    if not written_rows:
+        return
+    wb.save(file_path)
+    with open(journal_path, "a", encoding="utf-8") as journal:
+        for row, product_id in written_rows:
+            journal.write(f"{row}\t{product_id}\n")
+    logging.info(f"Workbook saved with {len(written_rows)} more rows: {file_path}")
+    written_rows.clear()
 
 
 def process_workbook(file_path):
+    # Rows saved by an earlier run are skipped, unless their product ID changed
+    journal_path = file_path + JOURNAL_SUFFIX
+    done = load_journal(journal_path)
+    written_rows = []
     try:
         wb = load_workbook(file_path, keep_vba=True)
         sheet = wb.active
 
-        processed_rows = 0
-
+        rows = []
         for row in range(STARTING_ROW, sheet.max_row + 1):
-            if processed_rows >= MAX_ROWS_TO_PROCESS:
-               break
+            if MAX_ROWS_TO_PROCESS and len(rows) >= MAX_ROWS_TO_PROCESS:
+                break
             product_id = sheet[f"{PRODUCT_ID_COLUMN}{row}"].value
-            if product_id:
-                logging.info(f"Updating parameters for ID {product_id} in row {row}")
-                update_parameters_in_sheet(sheet, product_id, row)
-                processed_rows += 1
+            if product_id and (row, str(product_id)) not in done:
+                rows.append((row, product_id))
+        logging.info(
+            f"{len(rows)} rows to process, {len(done)} already done according to {journal_path}"
+        )
 
-        wb.save(file_path)
+        # Chunks are fetched by WORKERS threads, cells are written here in row order
+        chunks = plan_chunks(rows)
+        results = {}
+        with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+            fetched = executor.map(
+                get_products_parameters, [product_ids for product_ids, _ in chunks]
+            )
+            for (_, chunk_rows), chunk_results in zip(chunks, fetched):
+                results.update(chunk_results)
+                for row, product_id in chunk_rows:
+                    logging.info(f"Updating parameters for ID {product_id} in row {row}")
+                    if update_parameters_in_sheet(
+                        sheet, product_id, row, results.get(str(product_id))
+                    ):
+                        written_rows.append((row, product_id))
+                if len(written_rows) >= SAVE_EVERY:
+                    save_progress(wb, file_path, journal_path, written_rows)
+
+        save_progress(wb, file_path, journal_path, written_rows)
         logging.info(f"Workbook processed and saved: {file_path}")
     except Exception as e:
         logging.error(f"Error occurred, saving progress and stopping script: {e}")
-        wb.save(file_path)
-        logging.info(f"Workbook saved: {file_path}")
+        save_progress(wb, file_path, journal_path, written_rows)
         raise
 
 
@@ -0,0 +1,127 @@
+import os
+import argparse
+import random
+import shutil
+import tempfile
+import time
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Font, PatternFill
+
+import allegro_difference
+
+
+def generate_workbooks(folder, rows, matches, columns=20, seed=0):
+    """
+    Writes a first file with `matches` product IDs in column J and a second file
+    with `rows` styled product rows (IDs in column L, a formula in the last column).
+    """
+    rng = random.Random(seed)
+    product_ids = [100000 + index for index in range(rows)]
+
+    first = Workbook()
+    sheet = first.active
+    for row, product_id in enumerate(rng.sample(product_ids, matches), start=5):
+        sheet.cell(row, 10, product_id)
+    first_path = os.path.join(folder, "first.xlsx")
+    first.save(first_path)
+
+    second = Workbook()
+    sheet = second.active
+    bold = Font(bold=True)
+    fill = PatternFill("solid", fgColor="FFFF00")
+    for column in range(1, columns + 1):
+        sheet.cell(1, column, f"Column {column}").font = bold
+    for row, product_id in enumerate(product_ids, start=2):
+        for column in range(1, columns):
+            sheet.cell(row, column, f"value {row}-{column}")
+        sheet.cell(row, 12, product_id).fill = fill
+        sheet.cell(row, columns, f"=LEN(A{row})+L{row}")
+    second_path = os.path.join(folder, "second.xlsx")
+    second.save(second_path)
+    return first_path, second_path
+
+
+def legacy_remove_rows(sheet, rows_to_delete):
+    """The previous implementation: one delete_rows call per matching row."""
+    for row in sorted(rows_to_delete, reverse=True):
+        sheet.delete_rows(row)
+
+
+def measure(second_path, values_to_check, compact, legacy_lookup=False, limit=None):
+    wb = load_workbook(second_path, keep_vba=True)
+    sheet = wb.active
+    start = time.perf_counter()
+    if legacy_lookup:
+        values = list(values_to_check)
+        rows_to_delete = [
+            row
+            for row in range(1, sheet.max_row + 1)
+            if sheet[f"L{row}"].value in values
+        ]
+    else:
+        rows_to_delete = allegro_difference.find_rows_to_delete(
+            sheet, allegro_difference.KEY_COLUMN_2, values_to_check
+        )
+    found = time.perf_counter()
+    if limit:
+        # Evenly spread, the cost of a deletion depends on the rows below it
+        step = max(1, len(rows_to_delete) // limit)
+        rows_to_delete = rows_to_delete[::step][:limit]
+    compact(sheet, rows_to_delete)
+    elapsed = time.perf_counter() - start
+    return found - start, elapsed - (found - start), sheet
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare row-by-row deletion with single-pass compaction"
+    )
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--matches", type=int, default=3000)
+    parser.add_argument("--columns", type=int, default=20)
+    parser.add_argument(
+        "--legacy-matches",
+        type=int,
+        default=100,
+        help="Rows deleted with the old implementation, its full time is extrapolated "
+        "from them (0 skips it, deleting thousands of rows takes hours)",
+    )
+    args = parser.parse_args()
+
+    folder = tempfile.mkdtemp()
+    try:
+        first_path, second_path = generate_workbooks(
+            folder, args.rows, args.matches, args.columns
+        )
+        wb1 = load_workbook(first_path, read_only=True)
+        values_to_check = allegro_difference.collect_keys(
+            wb1.active, allegro_difference.KEY_COLUMN_1, 5
+        )
+        wb1.close()
+        print(f"{args.rows} rows, {args.matches} to delete, {args.columns} columns")
+
+        print(f"{'variant':<20} {'lookup s':>9} {'delete s':>9} {'rows left':>10}")
+        if args.legacy_matches:
+            lookup, delete, sheet = measure(
+                second_path,
+                values_to_check,
+                legacy_remove_rows,
+                legacy_lookup=True,
+                limit=args.legacy_matches,
+            )
+            sampled = min(args.legacy_matches, args.matches)
+            estimate = delete * args.matches / sampled
+            print(
+                f"{'list + delete_rows':<20} {lookup:>9.2f} {estimate:>8.1f}* "
+                f"{args.rows + 1 - args.matches:>10}"
+            )
+        lookup, delete, sheet = measure(
+            second_path, values_to_check, allegro_difference.compact_rows
+        )
+        print(
+            f"{'set + compaction':<20} {lookup:>9.2f} {delete:>9.2f} {sheet.max_row:>10}"
+        )
+        if args.legacy_matches:
+            print(f"* extrapolated from deleting {sampled} rows")
+    finally:
+        shutil.rmtree(folder)
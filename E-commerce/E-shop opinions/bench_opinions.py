@@ -0,0 +1,91 @@
+import os
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import io
+import shutil
+import tempfile
+import time
+from aiohttp import web
+
+from mock_shop import create_app
+
+# The script name is not a valid module name
+spec = importlib.util.spec_from_file_location(
+    "e_shop_opinions",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "e-shop_opinions.py"),
+)
+e_shop_opinions = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(e_shop_opinions)
+
+
+async def run(opinion_type, concurrency, args):
+    """
+    Runs one export against a fresh mock shop, in an empty working directory.
+
+    The server shares the event loop with the scraper, which is fine as long as the
+    simulated latency dominates, as it does for the real shop.
+    """
+    app = create_app(
+        args.opinions, args.products, args.latency, args.jitter, args.error_rate
+    )
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    e_shop_opinions.SHOP_URL = f"http://127.0.0.1:{port}"
+
+    fetch = {
+        "product": e_shop_opinions.fetch_product_opinions,
+        "order": e_shop_opinions.fetch_order_opinions,
+    }[opinion_type]
+    folder = tempfile.mkdtemp()
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            rows = await fetch(concurrency, args.output)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(folder)
+        await runner.cleanup()
+    return elapsed, rows, app["stats"]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure opinion scraping throughput against mock_shop.py"
+    )
+    parser.add_argument("--type", choices=["product", "order"], default="product")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 5, 10, 20])
+    parser.add_argument("--opinions", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds per response"
+    )
+    parser.add_argument("--jitter", type=float, default=0.02, help="Seconds")
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests answered with 503",
+    )
+    parser.add_argument("--output", choices=["csv", "sqlite"], default="csv")
+    args = parser.parse_args()
+
+    # Short waits so retried errors do not dominate the measurement
+    e_shop_opinions.RETRY_DELAY = args.latency
+    print(
+        f"{'concurrency':>11} {'seconds':>9} {'pages':>6} {'errors':>7} {'names':>6} "
+        f"{'pages/s':>8} {'opinions/s':>11}"
+    )
+    for concurrency in args.concurrency:
+        elapsed, rows, stats = asyncio.run(run(args.type, concurrency, args))
+        print(
+            f"{concurrency:>11} {elapsed:>9.2f} {stats['pages']:>6} {stats['errors']:>7} "
+            f"{stats['names']:>6} {stats['pages'] / elapsed:>8.1f} {rows / elapsed:>11.0f}"
+        )
@@ -1,29 +1,143 @@
 import csv
+import sqlite3
 import asyncio
 import aiohttp
 import os
 import json
 import argparse
+import time
 from datetime import datetime
 
+SHOP_URL = "https://xxx.pl"
+OPINIONS_URL = "/ajax/opinions.php?action=get&type={}&language=pol&resultsLimit=100&shopId=1&resultsPage={}&ordersBy[0][elementName]=date&ordersBy[0][sortDirection]=DESC"
+PRODUCT_URL = "/ajax/projector.php?action=get&product={}&get=product"
+CONCURRENCY = 5
+MAX_PAGES = 1000  # safety limit if the shop never returns an empty page
+RETRIES = 3  # for pages answered with 429 or 5xx
+RETRY_DELAY = 1  # seconds, doubled after every attempt
+NAME_CONCURRENCY = 10
+NAME_CACHE_FILE = os.path.join("csv", "product_names.json")
+NAME_CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+START_DATE = "2023-01-01"  # first run only, later runs continue from the stored mark
+STATE_FILE = os.path.join("csv", "opinions_state.json")
+FLUSH_ROWS = 500  # rows buffered before they are written out
+CSV_FILES = {
+    "product": os.path.join("csv", "products_opinions.csv"),
+    "order": os.path.join("csv", "orders_opinions.csv"),
+}
+# Columns identifying an opinion, one order can have opinions on several products
+KEY_COLUMNS = {"product": (0, 2), "order": (0,)}
+DATABASE_FILE = "opinions.db"
+
 
 async def return_name(session, product_id):
-    url = (
-        f"https://xxx.pl/ajax/projector.php?action=get&product={product_id}&get=product"
-    )
+    url = SHOP_URL + PRODUCT_URL.format(product_id)
     async with session.get(url) as response:
         if response.headers.get("Content-Type") == "text/html; charset=utf-8":
             response_text = await response.text()
-
-            json_start = response_text.find('{"')
-            json_end = response_text.rfind("}") + 1
-            json_content = response_text[json_start:json_end]
-            json_data = json.loads(json_content)
-            return json_data["product"]["name"]
+            return extract_json(response_text)["product"]["name"]
         else:
             return "Unknown Product"
 
 
+def load_name_cache(path=NAME_CACHE_FILE):
+    """Loads the product ID -> {"name", "fetched"} cache, dropping expired entries."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            cache = json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    now = time.time()
+    return {
+        product_id: entry
+        for product_id, entry in cache.items()
+        if now - entry["fetched"] < NAME_CACHE_TTL
+    }
+
+
+def save_name_cache(cache, path=NAME_CACHE_FILE):
+    ensure_directory(os.path.dirname(path))
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(cache, file, ensure_ascii=False)
+    os.replace(temp_path, path)
+
+
+async def resolve_names(session, product_ids, cache, semaphore):
+    """
+    Returns the names of the given products, looking up each distinct uncached ID once.
+
+    Lookups run concurrently, limited by the semaphore, and their results are added
+    to the cache. Products whose name could not be read are not cached.
+
+    Args:
+    session (aiohttp.ClientSession): Session used for the requests.
+    product_ids (iterable): Product IDs, duplicates are looked up only once.
+    cache (dict): Product ID -> {"name", "fetched"} cache, updated in place.
+    semaphore (asyncio.Semaphore): Limits the lookups in flight.
+
+    Returns:
+    dict: Product ID -> product name.
+    """
+
+    async def lookup(product_id):
+        async with semaphore:
+            try:
+                return await return_name(session, product_id)
+            except (json.JSONDecodeError, KeyError):
+                return "Unknown Product"
+
+    # JSON object keys are strings, so the cache is keyed by str(product_id)
+    missing = list({str(product_id) for product_id in product_ids} - cache.keys())
+    names = await asyncio.gather(*(lookup(product_id) for product_id in missing))
+    for product_id, name in zip(missing, names):
+        if name != "Unknown Product":
+            cache[product_id] = {"name": name, "fetched": time.time()}
+
+    resolved = dict(zip(missing, names))
+    return {
+        product_id: resolved.get(str(product_id)) or cache[str(product_id)]["name"]
+        for product_id in product_ids
+    }
+
+
+def load_state(path=STATE_FILE):
+    """Loads the high-water marks, opinion type -> {"createDate", "orderSn"}."""
+    try:
+        with open(path, "r", encoding="utf-8") as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def save_state(state, path=STATE_FILE):
+    ensure_directory(os.path.dirname(path))
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(state, file, indent=2)
+    os.replace(temp_path, path)
+
+
+def is_new(opinion, mark):
+    """
+    Checks whether an opinion still has to be exported.
+
+    Without a mark every opinion created after START_DATE is new. With a mark the
+    comparison is inclusive, so opinions created in the same second as the newest
+    exported one are fetched again and deduplicated by the upsert.
+    """
+    if mark is None:
+        return check_date(opinion["createDate"], START_DATE)
+    return opinion["createDate"] >= mark["createDate"]
+
+
+def extract_json(response_text):
+    """Returns the JSON object the shop wraps in its HTML responses."""
+    json_start = response_text.find('{"')
+    json_end = response_text.rfind("}") + 1
+    return json.loads(response_text[json_start:json_end])
+
+
 def check_date(date_to_check, limit_date):
     date1 = datetime.strptime(date_to_check.split(" ")[0], "%Y-%m-%d")
     date2 = datetime.strptime(limit_date, "%Y-%m-%d")
@@ -57,124 +171,396 @@ def format_opinion_content(content):
         return '"' + content.replace('"', '\\"') + '"'
 
 
-async def fetch_product_opinions():
-    csv_folder = "csv"
-    csv_file = "products_opinions.csv"
-    date = "2023-01-01"
-    ensure_directory(csv_folder)
+async def fetch_page(session, semaphore, opinion_type, page):
+    """
+    Fetches one page of opinions.
 
-    url_template = "https://xxx.pl/ajax/opinions.php?action=get&type=product&language=pol&resultsLimit=100&shopId=1&resultsPage={}&ordersBy[0][elementName]=date&ordersBy[0][sortDirection]=DESC"
-    data = []
+    Returns:
+    list: The opinions on the page, or None if the response could not be decoded.
 
-    async with aiohttp.ClientSession() as session:
-        for i in range(10):
-            url = url_template.format(i)
+    Raises:
+    aiohttp.ClientResponseError: If the shop still answers with an error after RETRIES retries.
+    """
+    url = SHOP_URL + OPINIONS_URL.format(opinion_type, page)
+    for attempt in range(RETRIES + 1):
+        async with semaphore:
             async with session.get(url) as response:
-                response_text = await response.text()
+                retry = response.status == 429 or response.status >= 500
+                if not retry or attempt == RETRIES:
+                    response.raise_for_status()
+                    response_text = await response.text()
+                    break
+        print(f"Retrying {url} after HTTP {response.status}")
+        await asyncio.sleep(RETRY_DELAY * 2**attempt)
+
+    print(f"URL: {url}")
+    try:
+        return extract_json(response_text)["results"]
+    except (json.JSONDecodeError, KeyError):
+        print(f"Error decoding JSON from response for URL: {url}")
+        return None
+
+
+async def fetch_opinions(session, opinion_type, mark, concurrency=CONCURRENCY):
+    """
+    Yields the opinions that are new according to the mark, page by page and in page order.
 
-                json_start = response_text.find('{"')
-                json_end = response_text.rfind("}") + 1
-                json_content = response_text[json_start:json_end]
+    Up to `concurrency` pages are requested at once. Pages are sorted by date DESC, so
+    once a page reaches an opinion that is not new, or comes back empty, no further
+    pages are requested and the ones still in flight past it are cancelled. A failed
+    request is raised only after all pages before it have been yielded.
 
-                print(f"URL: {url}")
+    Args:
+    session (aiohttp.ClientSession): Session used for the requests.
+    opinion_type (str): "product" or "order".
+    mark (dict): High-water mark of the previous run, or None to start from START_DATE.
+    concurrency (int): Maximum number of pages fetched at the same time.
 
-                try:
-                    json_data = json.loads(json_content)
-                    opinions = json_data["results"]
+    Yields:
+    list: The new opinions of one page.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    pending = {}
+    fetched = {}
+    next_page = 0
+    next_to_yield = 0
+    last_page = MAX_PAGES - 1
+
+    def issue_pages():
+        nonlocal next_page
+        while len(pending) < concurrency and next_page <= last_page:
+            task = asyncio.create_task(
+                fetch_page(session, semaphore, opinion_type, next_page)
+            )
+            pending[task] = next_page
+            next_page += 1
+
+    issue_pages()
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                page = pending.pop(task)
+                if task.exception():
+                    # Raised once the pages before it have been yielded
+                    fetched[page] = task.exception()
+                    last_page = min(last_page, page)
+                    continue
+                opinions = task.result()
+                if opinions is not None:
+                    newer = [opinion for opinion in opinions if is_new(opinion, mark)]
+                    if not opinions:
+                        last_page = min(last_page, page - 1)
+                    elif len(newer) < len(opinions):
+                        print(f"Page {page} reaches already exported opinions")
+                        last_page = min(last_page, page)
+                    opinions = newer
+                fetched[page] = opinions or []
+
+            for task, page in list(pending.items()):
+                if page > last_page:
+                    task.cancel()
+                    del pending[task]
+            issue_pages()
+
+            while next_to_yield in fetched and next_to_yield <= last_page:
+                opinions = fetched.pop(next_to_yield)
+                if isinstance(opinions, Exception):
+                    raise opinions
+                yield opinions
+                next_to_yield += 1
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class OpinionWriter:
+    """
+    Streams rows into a CSV file, replacing existing rows with the same key.
 
-                    for opinion in opinions:
-                        if check_date(opinion["createDate"], date):
-                            product_name = await return_name(
-                                session, opinion["product"]["id"]
-                            )
-                            formatted_content = format_opinion_content(
-                                opinion["content"]
-                            )
-                            data.append(
-                                [
-                                    opinion["orderSn"],
-                                    opinion["createDate"],
-                                    opinion["product"]["id"],
-                                    product_name,
-                                    opinion["rating"],
-                                    formatted_content,
-                                ]
-                            )
-                        else:
-                            print(f"{opinion['createDate']} - before ", date)
-                except json.JSONDecodeError:
-                    print(f"Error decoding JSON from response for URL: {url}")
-
-        with open(
-            os.path.join(csv_folder, csv_file), "a", newline="", encoding="utf-8"
-        ) as file:
-            writer = csv.writer(file)
-            for row in data:
-                writer.writerow(row)
-
-
-async def fetch_order_opinions():
-    csv_folder = "csv"
-    csv_file = "orders_opinions.csv"
-    date = "2023-01-01"
-
-    ensure_directory(csv_folder)
-
-    url_template = "https://xxx.pl/ajax/opinions.php?action=get&type=order&language=pol&resultsLimit=100&shopId=1&resultsPage={}&ordersBy[0][elementName]=date&ordersBy[0][sortDirection]=DESC"
-    data = []
-
-    async with aiohttp.ClientSession() as session:
-        for i in range(10):
-            url = url_template.format(i)
-            async with session.get(url) as response:
-                response_text = await response.text()
+    Rows are buffered and written in batches of flush_rows to a temporary file, so
+    memory does not grow with the export. On exit the existing rows whose key was
+    not written are appended and the temporary file replaces the CSV file. This also
+    happens when the export fails part way, so the pages written so far are kept,
+    while a killed process leaves the previous file intact. The high-water mark is
+    kept in STATE_FILE and saved only after a complete export.
 
-                json_start = response_text.find('{"')
-                json_end = response_text.rfind("}") + 1
-                json_content = response_text[json_start:json_end]
+    Args:
+    opinion_type (str): "product" or "order".
+    csv_file (str): Path of the CSV file, CSV_FILES[opinion_type] by default.
+    flush_rows (int): Number of buffered rows that triggers a write.
+    """
 
-                print(f"URL: {url}")
+    def __init__(self, opinion_type, csv_file=None, flush_rows=FLUSH_ROWS):
+        self.opinion_type = opinion_type
+        self.csv_file = csv_file or CSV_FILES[opinion_type]
+        self.temp_path = self.csv_file + ".tmp"
+        self.key_columns = KEY_COLUMNS[opinion_type]
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.keys = set()
+        self.rows = 0
+        self.state = load_state()
+        self.mark = self.state.get(opinion_type)
+        self.new_mark = None
+
+    def __enter__(self):
+        ensure_directory(os.path.dirname(self.csv_file))
+        self.file = open(self.temp_path, "w", newline="", encoding="utf-8")
+        self.writer = csv.writer(self.file)
+        return self
+
+    def write(self, row):
+        """Adds a row, its last column is the raw opinion content."""
+        row = row[:-1] + [format_opinion_content(row[-1])]
+        self.buffer.append(row)
+        self.keys.add(self.key(row))
+        self.rows += 1
+        if len(self.buffer) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        self.writer.writerows(self.buffer)
+        self.buffer.clear()
+        self.file.flush()
+
+    def key(self, row):
+        return tuple(str(row[column]) for column in self.key_columns)
+
+    def complete(self, mark):
+        """Marks the export as complete, mark is saved once the file is in place."""
+        self.new_mark = mark
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.flush()
+            # The new rows come first, so the file stays sorted newest first
+            if os.path.exists(self.csv_file):
+                with open(self.csv_file, "r", newline="", encoding="utf-8") as existing:
+                    for row in csv.reader(existing):
+                        if self.key(row) not in self.keys:
+                            self.writer.writerow(row)
+            self.file.close()
+            os.replace(self.temp_path, self.csv_file)
+        except Exception:
+            self.file.close()
+            os.remove(self.temp_path)
+            raise
+        if exc_type is None and self.new_mark:
+            self.state[self.opinion_type] = self.new_mark
+            save_state(self.state)
+        return False
+
+
+class SqliteOpinionWriter:
+    """
+    Upserts rows into a SQLite database, with the same interface as OpinionWriter.
 
-                try:
-                    json_data = json.loads(json_content)
-                    opinions = json_data["results"]
+    Rows are inserted in batches of flush_rows, one transaction per batch, so the
+    batches written before a failure are kept. Opinions are indexed by product ID,
+    create date and rating for opinions_query.py. The high-water mark is stored in
+    the sync_state table of the same database.
 
+    Args:
+    opinion_type (str): "product" or "order".
+    database_file (str): Path of the database, DATABASE_FILE by default.
+    flush_rows (int): Number of buffered rows that triggers an insert.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS product_opinions (
+            order_sn TEXT NOT NULL,
+            create_date TEXT NOT NULL,
+            product_id TEXT NOT NULL,
+            product_name TEXT,
+            rating REAL,
+            content TEXT,
+            PRIMARY KEY (order_sn, product_id)
+        );
+        CREATE INDEX IF NOT EXISTS product_opinions_product_id ON product_opinions (product_id);
+        CREATE INDEX IF NOT EXISTS product_opinions_create_date ON product_opinions (create_date);
+        CREATE INDEX IF NOT EXISTS product_opinions_rating ON product_opinions (rating);
+        CREATE TABLE IF NOT EXISTS order_opinions (
+            order_sn TEXT PRIMARY KEY,
+            create_date TEXT NOT NULL,
+            rating REAL,
+            content TEXT
+        );
+        CREATE INDEX IF NOT EXISTS order_opinions_create_date ON order_opinions (create_date);
+        CREATE INDEX IF NOT EXISTS order_opinions_rating ON order_opinions (rating);
+        CREATE TABLE IF NOT EXISTS sync_state (
+            opinion_type TEXT PRIMARY KEY,
+            create_date TEXT NOT NULL,
+            order_sn TEXT NOT NULL
+        );
+    """
+    INSERTS = {
+        "product": "INSERT OR REPLACE INTO product_opinions VALUES (?, ?, ?, ?, ?, ?)",
+        "order": "INSERT OR REPLACE INTO order_opinions VALUES (?, ?, ?, ?)",
+    }
+
+    def __init__(
+        self, opinion_type, database_file=DATABASE_FILE, flush_rows=FLUSH_ROWS
+    ):
+        self.opinion_type = opinion_type
+        self.database_file = database_file
+        self.flush_rows = flush_rows
+        self.buffer = []
+        self.rows = 0
+        self.new_mark = None
+
+    def __enter__(self):
+        self.connection = sqlite3.connect(self.database_file)
+        self.connection.executescript(self.SCHEMA)
+        state = self.connection.execute(
+            "SELECT create_date, order_sn FROM sync_state WHERE opinion_type = ?",
+            (self.opinion_type,),
+        ).fetchone()
+        self.mark = {"createDate": state[0], "orderSn": state[1]} if state else None
+        return self
+
+    def write(self, row):
+        """Adds a row, its last column is the raw opinion content."""
+        self.buffer.append(row)
+        self.rows += 1
+        if len(self.buffer) >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        with self.connection:
+            self.connection.executemany(self.INSERTS[self.opinion_type], self.buffer)
+        self.buffer.clear()
+
+    def complete(self, mark):
+        """Marks the export as complete, mark is saved with the last batch."""
+        self.new_mark = mark
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            with self.connection:
+                self.connection.executemany(
+                    self.INSERTS[self.opinion_type], self.buffer
+                )
+                if exc_type is None and self.new_mark:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO sync_state VALUES (?, ?, ?)",
+                        (
+                            self.opinion_type,
+                            self.new_mark["createDate"],
+                            self.new_mark["orderSn"],
+                        ),
+                    )
+            self.buffer.clear()
+        finally:
+            self.connection.close()
+        return False
+
+
+def open_output(opinion_type, output):
+    if output == "sqlite":
+        return SqliteOpinionWriter(opinion_type)
+    return OpinionWriter(opinion_type)
+
+
+def newest_mark(opinions, mark):
+    for opinion in opinions:
+        if mark is None or opinion["createDate"] > mark["createDate"]:
+            mark = {"createDate": opinion["createDate"], "orderSn": opinion["orderSn"]}
+    return mark
+
+
+async def fetch_product_opinions(concurrency=CONCURRENCY, output="csv"):
+    name_cache = load_name_cache()
+    name_semaphore = asyncio.Semaphore(NAME_CONCURRENCY)
+    lookups = 0
+
+    with open_output("product", output) as writer:
+        new_mark = writer.mark
+        try:
+            async with aiohttp.ClientSession() as session:
+                async for opinions in fetch_opinions(
+                    session, "product", writer.mark, concurrency
+                ):
+                    new_mark = newest_mark(opinions, new_mark)
+                    product_ids = {opinion["product"]["id"] for opinion in opinions}
+                    lookups += len(
+                        {str(product_id) for product_id in product_ids}
+                        - name_cache.keys()
+                    )
+                    names = await resolve_names(
+                        session, product_ids, name_cache, name_semaphore
+                    )
                     for opinion in opinions:
-                        if check_date(opinion["createDate"], date):
-                            formatted_content = format_opinion_content(
-                                opinion["content"]
-                            )
-                            data.append(
-                                [
-                                    opinion["orderSn"],
-                                    opinion["createDate"],
-                                    opinion["rating"],
-                                    formatted_content,
-                                ]
-                            )
-                        else:
-                            print(f"{opinion['createDate']} - before ", date)
-                except json.JSONDecodeError:
-                    print(f"Error decoding JSON from response for URL: {url}")
-
-        with open(
-            os.path.join(csv_folder, csv_file), "a", newline="", encoding="utf-8"
-        ) as file:
-            writer = csv.writer(file)
-            for row in data:
-                writer.writerow(row)
-
-
-parser = argparse.ArgumentParser(description="Fetch opinions from e-shop.")
-parser.add_argument(
-    "type",
-    choices=["product", "order"],
-    help="Type of opinions to fetch: product or order",
-)
-args = parser.parse_args()
-
-
-if args.type == "product":
-    asyncio.run(fetch_product_opinions())
-elif args.type == "order":
-    asyncio.run(fetch_order_opinions())
+                        writer.write(
+                            [
+                                opinion["orderSn"],
+                                opinion["createDate"],
+                                opinion["product"]["id"],
+                                names[opinion["product"]["id"]],
+                                opinion["rating"],
+                                opinion["content"].strip(),
+                            ]
+                        )
+        finally:
+            save_name_cache(name_cache)
+        # Only after a complete run, a failed one starts again from the old mark
+        writer.complete(new_mark)
+
+    print(f"{writer.rows} opinions, {lookups} product name lookups")
+    return writer.rows
+
+
+async def fetch_order_opinions(concurrency=CONCURRENCY, output="csv"):
+    with open_output("order", output) as writer:
+        new_mark = writer.mark
+        async with aiohttp.ClientSession() as session:
+            async for opinions in fetch_opinions(
+                session, "order", writer.mark, concurrency
+            ):
+                new_mark = newest_mark(opinions, new_mark)
+                for opinion in opinions:
+                    writer.write(
+                        [
+                            opinion["orderSn"],
+                            opinion["createDate"],
+                            opinion["rating"],
+                            opinion["content"].strip(),
+                        ]
+                    )
+        writer.complete(new_mark)
+
+    print(f"{writer.rows} opinions")
+    return writer.rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fetch opinions from e-shop.")
+    parser.add_argument(
+        "type",
+        choices=["product", "order"],
+        help="Type of opinions to fetch: product or order",
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=CONCURRENCY,
+        help=f"Pages fetched at the same time (default: {CONCURRENCY})",
+    )
+    parser.add_argument(
+        "--shop-url",
+        default=SHOP_URL,
+        help="Shop address, e.g. http://localhost:8080 for mock_shop.py",
+    )
+    parser.add_argument(
+        "--output",
+        choices=["csv", "sqlite"],
+        default="csv",
+        help=f"Write to the CSV files in csv/ or to the {DATABASE_FILE} database",
+    )
+    args = parser.parse_args()
+
+    SHOP_URL = args.shop_url.rstrip("/")
+    if args.type == "product":
+        asyncio.run(fetch_product_opinions(args.concurrency, args.output))
+    elif args.type == "order":
+        asyncio.run(fetch_order_opinions(args.concurrency, args.output))
@@ -0,0 +1,126 @@
+import json
+import random
+import argparse
+import asyncio
+from datetime import datetime, timedelta
+from aiohttp import web
+
+
+def generate_opinions(count, products, seed=0):
+    """Opinions sorted newest first, one every 20 minutes, orders with 1-3 products."""
+    rng = random.Random(seed)
+    start = datetime(2024, 6, 1)
+    opinions = []
+    order_sn = 100000
+    while len(opinions) < count:
+        order_sn += 1
+        for product_id in rng.sample(range(1, products + 1), rng.randint(1, 3)):
+            opinions.append(
+                {
+                    "orderSn": order_sn,
+                    "createDate": (
+                        start - timedelta(minutes=20 * len(opinions))
+                    ).strftime("%Y-%m-%d %H:%M:%S"),
+                    "product": {"id": product_id},
+                    "rating": rng.choice([1, 2, 3, 4, 5, 5, 5, 4]),
+                    "content": f'Opinion {len(opinions)} "quoted" '
+                    + "lorem " * rng.randint(5, 40),
+                }
+            )
+    return opinions[:count]
+
+
+def wrap(data):
+    """The shop answers with the JSON embedded in an HTML document."""
+    return (
+        f"<html><body><script>var response = {json.dumps(data)};</script></body></html>"
+    )
+
+
+def create_app(
+    opinions=5000, products=200, latency=0.05, jitter=0.02, error_rate=0.0, seed=0
+):
+    """
+    Builds a stand-in for the shop's /ajax/opinions.php and /ajax/projector.php.
+
+    Every request waits latency +- jitter seconds and fails with HTTP 503 with
+    probability error_rate. Counters of served requests are kept in app["stats"].
+
+    Args:
+    opinions (int): Number of opinions served, for both product and order opinions.
+    products (int): Number of distinct products the opinions refer to.
+    latency (float): Seconds per response.
+    jitter (float): Maximum random deviation from latency, in seconds.
+    error_rate (float): Share of requests answered with HTTP 503.
+    seed (int): Seed for the generated data and the errors.
+
+    Returns:
+    web.Application: The application, see run_app or web.AppRunner.
+    """
+    rng = random.Random(seed)
+    data = generate_opinions(opinions, products, seed)
+    orders = list({opinion["orderSn"]: opinion for opinion in data}.values())
+    stats = {"pages": 0, "opinions": 0, "names": 0, "errors": 0}
+
+    async def respond(request):
+        await asyncio.sleep(max(0, latency + rng.uniform(-jitter, jitter)))
+        if rng.random() < error_rate:
+            stats["errors"] += 1
+            raise web.HTTPServiceUnavailable()
+
+    async def opinions_handler(request):
+        await respond(request)
+        limit = int(request.query.get("resultsLimit", 100))
+        page = int(request.query.get("resultsPage", 0))
+        source = orders if request.query.get("type") == "order" else data
+        results = source[page * limit : (page + 1) * limit]
+        if request.query.get("type") == "order":
+            results = [
+                {key: value for key, value in opinion.items() if key != "product"}
+                for opinion in results
+            ]
+        stats["pages"] += 1
+        stats["opinions"] += len(results)
+        return web.Response(text=wrap({"results": results}), content_type="text/html")
+
+    async def product_handler(request):
+        await respond(request)
+        product_id = request.query.get("product")
+        stats["names"] += 1
+        return web.Response(
+            text=wrap({"product": {"id": product_id, "name": f"Product {product_id}"}}),
+            content_type="text/html",
+        )
+
+    app = web.Application()
+    app["stats"] = stats
+    app.router.add_get("/ajax/opinions.php", opinions_handler)
+    app.router.add_get("/ajax/projector.php", product_handler)
+    return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the shop's opinion endpoints"
+    )
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--opinions", type=int, default=5000)
+    parser.add_argument("--products", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="Seconds per response"
+    )
+    parser.add_argument("--jitter", type=float, default=0.02, help="Seconds")
+    parser.add_argument(
+        "--error-rate",
+        type=float,
+        default=0.0,
+        help="Share of requests answered with 503",
+    )
+    args = parser.parse_args()
+
+    web.run_app(
+        create_app(
+            args.opinions, args.products, args.latency, args.jitter, args.error_rate
+        ),
+        port=args.port,
+    )
@@ -0,0 +1,119 @@
+import sqlite3
+import argparse
+import time
+from datetime import date
+
+DATABASE_FILE = "opinions.db"  # written by e-shop_opinions.py --output sqlite
+
+QUERIES = {
+    "products": """
+        SELECT product_id, product_name, COUNT(*) AS opinions, ROUND(AVG(rating), 2) AS average
+        FROM product_opinions
+        WHERE create_date >= :since
+        GROUP BY product_id
+        HAVING COUNT(*) >= :min_count
+        ORDER BY average ASC, opinions DESC
+        LIMIT :limit
+    """,
+    "low": """
+        SELECT order_sn, create_date, product_id, product_name, rating, content
+        FROM product_opinions
+        WHERE create_date >= :since AND rating <= :max_rating
+        ORDER BY create_date DESC
+        LIMIT :limit
+    """,
+    "low-orders": """
+        SELECT order_sn, create_date, rating, content
+        FROM order_opinions
+        WHERE create_date >= :since AND rating <= :max_rating
+        ORDER BY create_date DESC
+        LIMIT :limit
+    """,
+    "monthly": """
+        SELECT substr(create_date, 1, 7) AS month, COUNT(*) AS opinions, ROUND(AVG(rating), 2) AS average
+        FROM product_opinions
+        WHERE create_date >= :since
+        GROUP BY month
+        ORDER BY month DESC
+        LIMIT :limit
+    """,
+}
+
+
+def run_query(database_file, query, parameters):
+    """
+    Runs one of QUERIES against the opinions database.
+
+    Args:
+    database_file (str): Path of the database.
+    query (str): Key of QUERIES.
+    parameters (dict): Values for the named parameters of the query.
+
+    Returns:
+    tuple: Column names and result rows.
+    """
+    connection = sqlite3.connect(f"file:{database_file}?mode=ro", uri=True)
+    try:
+        cursor = connection.execute(QUERIES[query], parameters)
+        columns = [column[0] for column in cursor.description]
+        return columns, cursor.fetchall()
+    finally:
+        connection.close()
+
+
+def print_table(columns, rows, width=60):
+    cells = [[str(value)[:width] for value in row] for row in rows]
+    widths = [
+        max([len(column)] + [len(row[index]) for row in cells])
+        for index, column in enumerate(columns)
+    ]
+    print("  ".join(column.ljust(size) for column, size in zip(columns, widths)))
+    for row in cells:
+        print("  ".join(value.ljust(size) for value, size in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Common aggregates over the opinions database"
+    )
+    parser.add_argument(
+        "query",
+        choices=QUERIES,
+        help="products: average rating per product, low/low-orders: low ratings, monthly: opinions per month",
+    )
+    parser.add_argument(
+        "--since",
+        default=None,
+        help="Only opinions created on or after this date, YYYY-MM-DD (default: all, low ratings: this month)",
+    )
+    parser.add_argument("--max-rating", type=float, default=2, help="Low rating limit")
+    parser.add_argument(
+        "--min-count",
+        type=int,
+        default=1,
+        help="Products with fewer opinions are skipped",
+    )
+    parser.add_argument("--limit", type=int, default=50)
+    parser.add_argument("--database", default=DATABASE_FILE)
+    args = parser.parse_args()
+
+    since = args.since
+    if since is None:
+        since = (
+            date.today().strftime("%Y-%m-01") if args.query.startswith("low") else ""
+        )
+
+    start = time.perf_counter()
+    columns, rows = run_query(
+        args.database,
+        args.query,
+        {
+            "since": since,
+            "max_rating": args.max_rating,
+            "min_count": args.min_count,
+            "limit": args.limit,
+        },
+    )
+    elapsed = time.perf_counter() - start
+    print_table(columns, rows)
+    print(f"\n{len(rows)} rows in {elapsed * 1000:.1f} ms")
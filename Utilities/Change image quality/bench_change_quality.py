@@ -0,0 +1,192 @@
+import os
+import sys
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import platform
+import random
+import resource
+import shutil
+import tempfile
+import time
+import PIL
+from PIL import Image, ImageDraw
+
+from change_quality import change_quality
+
+
+FORMATS = ["jpg", "png", "bmp"]
+
+
+def generate_images(folder, count, width, height, seed=0, extension="jpg"):
+    """Writes photo-like images (gradient, shapes and noise) so the encoder has real work."""
+    rng = random.Random(seed)
+    for index in range(count):
+        img = Image.radial_gradient("L").resize((width, height)).convert("RGB")
+        draw = ImageDraw.Draw(img)
+        for _ in range(30):
+            x, y = rng.randrange(width), rng.randrange(height)
+            color = tuple(rng.randrange(256) for _ in range(3))
+            draw.ellipse((x, y, x + width // 8, y + height // 8), fill=color)
+        noise = Image.effect_noise((width, height), 40).convert("RGB")
+        img = Image.blend(img, noise, 0.3)
+        img.save(os.path.join(folder, f"image_{index:05}.{extension}"), quality=95)
+
+
+def folder_size(folder):
+    return sum(entry.stat().st_size for entry in os.scandir(folder) if entry.is_file())
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    peaks = [
+        resource.getrusage(who).ru_maxrss
+        for who in (resource.RUSAGE_SELF, resource.RUSAGE_CHILDREN)
+    ]
+    return max(peaks) / scale
+
+
+def measure(source_folder, workers, quality, max_size, results):
+    output_folder = tempfile.mkdtemp()
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            change_quality(source_folder, output_folder, quality, workers, max_size)
+        results.put((time.perf_counter() - start, peak_rss_mb()))
+    finally:
+        shutil.rmtree(output_folder)
+
+
+def run(source_folder, workers, quality, max_size=None):
+    """Runs one measurement in a fresh process so peak RSS is not shared between runs."""
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+    process = context.Process(
+        target=measure, args=(source_folder, workers, quality, max_size, results)
+    )
+    process.start()
+    elapsed, peak = results.get()
+    process.join()
+    return elapsed, peak
+
+
+def compare(results, previous_path):
+    """Prints the change in images/s against the matching rows of a previous JSON run."""
+    with open(previous_path, "r", encoding="utf-8") as file:
+        previous = json.load(file)
+    keys = ("format", "workers", "max_size")
+    before = {tuple(row[key] for key in keys): row for row in previous["results"]}
+    print(f"\nCompared with {previous_path} (Pillow {previous['pillow']}):")
+    print(f"{'format':>7} {'workers':>8} {'max size':>9} {'images/s':>17} {'change':>8}")
+    for row in results:
+        old = before.get(tuple(row[key] for key in keys))
+        if not old:
+            continue
+        change = row["images_per_s"] / old["images_per_s"] - 1
+        throughput = f"{old['images_per_s']:.1f} -> {row['images_per_s']:.1f}"
+        print(
+            f"{row['format']:>7} {row['workers']:>8} {row['max_size'] or 'full':>9} "
+            f"{throughput:>17} {change:>+8.1%}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure serial and parallel recompression on synthetic images"
+    )
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--width", type=int, default=1600)
+    parser.add_argument("--height", type=int, default=1200)
+    parser.add_argument("--quality", type=int, default=70)
+    parser.add_argument(
+        "--formats",
+        nargs="+",
+        choices=FORMATS,
+        default=FORMATS,
+        help="Source formats to generate a corpus for",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=sorted({1, 2, 4, os.cpu_count()}),
+        help="Worker counts to compare, 1 is the serial path",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        help="Also measure --max-size decoding against full decoding",
+    )
+    parser.add_argument("--json", type=str, help="Write the results to this JSON file")
+    parser.add_argument(
+        "--compare", type=str, help="Previous --json output to compare the results with"
+    )
+    args = parser.parse_args()
+
+    results = []
+    variants = [None, args.max_size] if args.max_size else [None]
+    print(
+        f"{'format':>7} {'workers':>8} {'max size':>9} {'seconds':>9} {'images/s':>9} "
+        f"{'MB/s':>8} {'speedup':>8} {'peak MB':>8}"
+    )
+    for extension in args.formats:
+        source_folder = tempfile.mkdtemp()
+        try:
+            # Generated in a child process, peak RSS carries over from parent to child
+            context = multiprocessing.get_context("spawn")
+            generator = context.Process(
+                target=generate_images,
+                args=(source_folder, args.count, args.width, args.height, 0, extension),
+            )
+            generator.start()
+            generator.join()
+            megabytes = folder_size(source_folder) / 1024 / 1024
+            for max_size in variants:
+                baseline = None
+                for workers in args.workers:
+                    elapsed, peak = run(source_folder, workers, args.quality, max_size)
+                    baseline = baseline or elapsed
+                    results.append(
+                        {
+                            "format": extension,
+                            "workers": workers,
+                            "max_size": max_size,
+                            "seconds": elapsed,
+                            "images_per_s": args.count / elapsed,
+                            "mb_per_s": megabytes / elapsed,
+                            "speedup": baseline / elapsed,
+                            "peak_rss_mb": peak,
+                        }
+                    )
+                    print(
+                        f"{extension:>7} {workers:>8} {max_size or 'full':>9} {elapsed:>9.2f} "
+                        f"{args.count / elapsed:>9.1f} {megabytes / elapsed:>8.1f} "
+                        f"{baseline / elapsed:>7.2f}x {peak:>8.0f}"
+                    )
+        finally:
+            shutil.rmtree(source_folder)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "python": platform.python_version(),
+                    "pillow": PIL.__version__,
+                    "cpu_count": os.cpu_count(),
+                    "corpus": {
+                        "count": args.count,
+                        "width": args.width,
+                        "height": args.height,
+                        "quality": args.quality,
+                    },
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+    if args.compare:
+        compare(results, args.compare)
@@ -1,53 +1,511 @@
 import os
+import io
+import json
+import math
+import hashlib
+import shutil
 import argparse
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from PIL import Image
 
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".gif", ".bmp")
+CHUNK_SIZE = 8  # images sent to a worker process at once
+MANIFEST_NAME = ".change_quality_manifest.json"
+MANIFEST_JOURNAL = ".change_quality_manifest.journal"  # entries since the last save
+MANIFEST_SAVE_EVERY = 500  # results between journal appends
+PROGRESS_INTERVAL = 0.5  # seconds between progress updates
+MIN_QUALITY = 5  # lowest quality tried by --target-kb
+QUALITY_FORMATS = ("JPEG", "WEBP")  # formats where quality changes the file size
 
-def change_quality(source_folder, output_folder, quality=70):
-    if not os.path.exists(output_folder):
-        os.makedirs(output_folder)
+# Quality that met the size budget for earlier similar images, per worker process
+quality_seeds = {}
 
-    files = os.listdir(source_folder)
 
-    image_files = [
-        file
-        for file in files
-        if file.lower().endswith((".jpg", ".jpeg", ".png", ".gif", ".bmp"))
-    ]
+def resize_image(img, max_size):
+    """
+    Shrinks img to fit in max_size x max_size without decoding it at full resolution.
 
-    total_images = len(image_files)
-    processed_images = 0
+    For JPEGs draft() lets the decoder scale by 1/2, 1/4 or 1/8 while decoding, so a
+    50 MP original is never held in memory at full size. thumbnail() then reduces the
+    rest of the way and never enlarges smaller images.
+    """
+    if img.format == "JPEG":
+        img.draft(img.mode, (max_size, max_size))
+    img.thumbnail((max_size, max_size), Image.Resampling.BICUBIC, reducing_gap=2.0)
+    return img
+
+
+def find_quality(fits, low, high, start):
+    """
+    Returns the highest quality in [low, high] for which fits(quality) is true.
+
+    The search probes outwards from start in growing steps and then bisects the
+    remaining gap, so a start close to the answer needs only a few encodes. Returns
+    None when not even `low` fits.
+    """
+    start = min(max(start, low), high)
+    if fits(start):
+        good, step = start, 1
+        while good < high:
+            probe = min(high, good + step)
+            if not fits(probe):
+                high = probe - 1
+                break
+            good, step = probe, step * 2
+        low = good
+    else:
+        bad, step = start, 1
+        while True:
+            probe = bad - step
+            if probe <= low:
+                if not fits(low):
+                    return None
+                break
+            if fits(probe):
+                low = probe
+                break
+            bad, step = probe, step * 2
+        high = bad - 1
+    while low < high:
+        middle = (low + high + 1) // 2
+        if fits(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
+
+
+def similarity_key(img, image_format, source_bytes, source_pixels):
+    # Same format, similar output size and similar source bytes per pixel
+    bytes_per_pixel = source_bytes / max(1, source_pixels)
+    return (
+        image_format,
+        round(math.log2(max(1, img.width * img.height))),
+        round(math.log2(max(bytes_per_pixel, 1e-3)) * 2),
+    )
+
+
+def encode_to_budget(img, image_format, settings, source_bytes, source_pixels):
+    """
+    Encodes img in memory at the highest quality that fits settings["target_kb"].
+
+    The search starts at the quality found for the last similar image in this
+    process. Returns the encoded bytes and the number of trial encodes.
+    """
+    budget = settings["target_kb"] * 1024
+    encodes = {}
+
+    def encode(quality):
+        if quality not in encodes:
+            buffer = io.BytesIO()
+            img.save(buffer, format=image_format, quality=quality)
+            encodes[quality] = buffer.getvalue()
+        return encodes[quality]
+
+    def fits(quality):
+        return len(encode(quality)) <= budget
+
+    key = similarity_key(img, image_format, source_bytes, source_pixels)
+    start = quality_seeds.get(key, settings["quality"])
+    quality = find_quality(fits, MIN_QUALITY, settings["quality"], start)
+    if quality is None:
+        quality = MIN_QUALITY  # cannot reach the budget, keep the smallest encode
+    else:
+        quality_seeds[key] = quality
+    return encode(quality), len(encodes)
+
+
+def output_format(output_path):
+    extension = os.path.splitext(output_path)[1].lower()
+    return Image.registered_extensions().get(extension)
+
+
+def recompress_image(data, output_path, settings):
+    """Writes the recompressed image and returns the number of encodes it took."""
+    with Image.open(io.BytesIO(data)) as img:
+        source_pixels = img.width * img.height
+        if settings.get("max_size"):
+            img = resize_image(img, settings["max_size"])
+        image_format = output_format(output_path) or img.format
+        # Written to a new file and renamed, so hardlinked duplicates keep their content
+        temp_path = output_path + ".tmp"
+        if settings.get("target_kb") and image_format in QUALITY_FORMATS:
+            encoded, encodes = encode_to_budget(
+                img, image_format, settings, len(data), source_pixels
+            )
+            with open(temp_path, "wb") as file:
+                file.write(encoded)
+        else:
+            img.save(temp_path, format=image_format, quality=settings["quality"])
+            encodes = 1
+        os.replace(temp_path, output_path)
+        return encodes
 
-    for filename in image_files:
-        try:
-            image_path = os.path.join(source_folder, filename)
-            img = Image.open(image_path)
 
-            output_path = os.path.join(output_folder, filename)
-            img.save(output_path, quality=quality)
+def process_image(image_path, output_path, settings, record):
+    start = time.process_time()
+    with open(image_path, "rb") as file:
+        data = file.read()
+    encodes = recompress_image(data, output_path, settings)
+    return dict(record, cpu=time.process_time() - start), encodes
 
-            processed_images += 1
-            progress_percentage = (processed_images / total_images) * 100
-            print(f"\rProcessing... {int(progress_percentage)}%", end="", flush=True)
 
+def process_chunk(tasks):
+    """
+    Recompresses a chunk of images, usually inside a worker process.
+
+    Errors are caught per file and returned with the results, so one broken image
+    does not take the rest of the chunk or the pool down with it.
+
+    Args:
+    tasks (list): (image_path, output_path, settings, record) tuples.
+
+    Returns:
+    list: Result dicts with the image path, the manifest record (with the CPU time
+    spent once encoded), the number of encodes and the error message, if any.
+    """
+    results = []
+    for image_path, output_path, settings, record in tasks:
+        try:
+            record, encodes = process_image(image_path, output_path, settings, record)
+            results.append(
+                {"path": image_path, "record": record, "encodes": encodes, "error": None}
+            )
         except Exception as e:
-            print(f"\nError processing '{filename}': {e}")
+            results.append(
+                {"path": image_path, "record": record, "encodes": 0, "error": str(e)}
+            )
+    return results
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_output(existing_path, output_path):
+    """Hardlinks output_path to an already encoded file, copying where links are not supported."""
+    if os.path.exists(output_path):
+        os.remove(output_path)
+    try:
+        os.link(existing_path, output_path)
+    except OSError:
+        shutil.copyfile(existing_path, output_path)
+
+
+def load_manifest(output_folder):
+    """Reads the manifest and applies the journal left by an interrupted run."""
+    try:
+        with open(os.path.join(output_folder, MANIFEST_NAME), "r") as file:
+            manifest = json.load(file)
+    except FileNotFoundError:
+        manifest = {}
+    try:
+        with open(os.path.join(output_folder, MANIFEST_JOURNAL), "r") as file:
+            for line in file:
+                try:
+                    relpath, entry = json.loads(line)
+                except ValueError:
+                    break  # the last line may be cut off by the interruption
+                manifest[relpath] = entry
+    except FileNotFoundError:
+        pass
+    return manifest
+
+
+def append_manifest(output_folder, manifest, relpaths):
+    """Appends the entries of relpaths to the journal instead of rewriting the manifest."""
+    if not relpaths:
+        return
+    with open(os.path.join(output_folder, MANIFEST_JOURNAL), "a") as file:
+        for relpath in relpaths:
+            file.write(json.dumps([relpath, manifest[relpath]]) + "\n")
+    relpaths.clear()
+
+
+def save_manifest(output_folder, manifest):
+    path = os.path.join(output_folder, MANIFEST_NAME)
+    with open(path + ".tmp", "w") as file:
+        json.dump(manifest, file)
+    os.replace(path + ".tmp", path)
+    try:
+        os.remove(os.path.join(output_folder, MANIFEST_JOURNAL))
+    except FileNotFoundError:
+        pass
+
+
+def is_unchanged(entry, stat, settings, output_path):
+    """True when size, mtime and settings match the manifest entry and the output exists."""
+    return (
+        entry is not None
+        and entry["settings"] == settings
+        and entry["size"] == stat.st_size
+        and entry["mtime"] == stat.st_mtime_ns
+        and os.path.exists(output_path)
+    )
+
+
+def scan_images(source_folder, exclude_folder=None):
+    """
+    Yields the paths of images under source_folder, relative to it.
+
+    Directories are read lazily with os.scandir, so the first image is yielded before
+    the whole tree has been listed. exclude_folder (the output folder) is not entered.
+    """
+    exclude = os.path.realpath(exclude_folder) if exclude_folder else None
+    stack = [source_folder]
+    while stack:
+        folder = stack.pop()
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    if os.path.realpath(entry.path) != exclude:
+                        stack.append(entry.path)
+                elif entry.is_file() and entry.name.lower().endswith(IMAGE_EXTENSIONS):
+                    yield os.path.relpath(entry.path, source_folder)
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_serial(tasks):
+    for task in tasks:
+        yield from process_chunk([task])
+
+
+def run_parallel(tasks, workers, chunk_size=CHUNK_SIZE):
+    # Only a few chunks per worker are queued, the rest waits in `tasks`
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = set()
+        for chunk in chunked(tasks, chunk_size):
+            if len(pending) >= workers * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield from future.result()
+            pending.add(pool.submit(process_chunk, chunk))
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield from future.result()
+
+
+def change_quality(
+    source_folder,
+    output_folder,
+    quality=70,
+    workers=1,
+    max_size=None,
+    target_kb=None,
+):
+    """
+    Recompresses every image under source_folder into output_folder.
+
+    The source tree is mirrored into output_folder and scanned lazily, so encoding
+    starts as soon as the first image is found. Images recorded as unchanged in the
+    output manifest are skipped. Images with the same content are encoded once and
+    the other copies are hardlinked to that output. With max_size images are scaled
+    down to fit in a max_size x max_size box. With target_kb JPEG and WebP images get
+    the highest quality, up to `quality`, whose file fits in target_kb kilobytes.
+
+    Returns:
+    dict: Numbers of processed, unchanged, duplicate and failed images, of encodes
+    and the CPU seconds saved by linking duplicates.
+    """
+    os.makedirs(output_folder, exist_ok=True)
+
+    settings = {"quality": quality}
+    if max_size:
+        settings["max_size"] = max_size
+    if target_kb:
+        settings["target_kb"] = target_kb
+    manifest = load_manifest(output_folder)
+    counts = {
+        "processed": 0,
+        "unchanged": 0,
+        "duplicates": 0,
+        "failed": 0,
+        "encodes": 0,
+        "cpu_saved": 0.0,
+    }
+    created_folders = {output_folder}
+    # Manifest entries changed since the last journal append
+    changed = []
+
+    # (content hash, output format) -> relpath of an output encoded with these settings
+    encoded = {
+        (entry["hash"], output_format(relpath)): relpath
+        for relpath, entry in manifest.items()
+        if entry["settings"] == settings
+    }
+    # content hash key -> duplicates waiting for the first copy to be encoded
+    waiting = {}
+
+    def add_duplicate(relpath, record, original):
+        link_output(
+            os.path.join(output_folder, original), os.path.join(output_folder, relpath)
+        )
+        manifest[relpath] = dict(record, cpu=manifest[original].get("cpu", 0))
+        changed.append(relpath)
+        counts["duplicates"] += 1
+        counts["cpu_saved"] += manifest[relpath]["cpu"]
+
+    def tasks():
+        for relpath in scan_images(source_folder, output_folder):
+            image_path = os.path.join(source_folder, relpath)
+            output_path = os.path.join(output_folder, relpath)
+            stat = os.stat(image_path)
+            entry = manifest.get(relpath)
+            if is_unchanged(entry, stat, settings, output_path):
+                counts["unchanged"] += 1
+                continue
+
+            folder = os.path.dirname(output_path)
+            if folder not in created_folders:
+                os.makedirs(folder, exist_ok=True)
+                created_folders.add(folder)
+
+            record = {
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "hash": file_hash(image_path),
+                "settings": settings,
+            }
+            if (
+                entry
+                and entry["hash"] == record["hash"]
+                and entry["settings"] == settings
+                and os.path.exists(output_path)
+            ):
+                # Touched but identical content, the existing output is still valid
+                manifest[relpath] = dict(record, cpu=entry.get("cpu", 0))
+                changed.append(relpath)
+                counts["unchanged"] += 1
+                continue
+
+            if entry:
+                # The output is about to be replaced, so it no longer holds the old content
+                stale = (entry["hash"], output_format(relpath))
+                if encoded.get(stale) == relpath:
+                    del encoded[stale]
+            key = (record["hash"], output_format(relpath))
+            original = encoded.get(key)
+            if original and (
+                manifest.get(original, {}).get("hash") != record["hash"]
+                or not os.path.exists(os.path.join(output_folder, original))
+            ):
+                original = None
+            if original:
+                add_duplicate(relpath, record, original)
+            elif key in waiting:
+                waiting[key].append((relpath, record))
+            else:
+                waiting[key] = []
+                yield image_path, output_path, settings, record
+
+    results = run_parallel(tasks(), workers) if workers > 1 else run_serial(tasks())
+    handled_images = 0
+    shown_at = 0
+    for result in results:
+        relpath = os.path.relpath(result["path"], source_folder)
+        record = result["record"]
+        key = (record["hash"], output_format(relpath))
+        duplicates = waiting.pop(key, [])
+        if result["error"]:
+            # Identical files would fail the same way
+            for failed in [relpath] + [duplicate for duplicate, _ in duplicates]:
+                counts["failed"] += 1
+                print(f"\nError processing '{failed}': {result['error']}")
+        else:
+            manifest[relpath] = record
+            changed.append(relpath)
+            encoded[key] = relpath
+            counts["processed"] += 1
+            counts["encodes"] += result["encodes"]
+            # Identical files found while this one was being encoded
+            for duplicate, duplicate_record in duplicates:
+                add_duplicate(duplicate, duplicate_record, relpath)
+
+        handled_images += 1
+        if handled_images % MANIFEST_SAVE_EVERY == 0:
+            append_manifest(output_folder, manifest, changed)
+        if time.monotonic() - shown_at >= PROGRESS_INTERVAL:
+            shown_at = time.monotonic()
+            print(
+                f"\rProcessing... {counts['processed']} processed, {counts['duplicates']} duplicates, {counts['unchanged']} unchanged, {counts['failed']} failed",
+                end="",
+                flush=True,
+            )
+
+    save_manifest(output_folder, manifest)
+    return counts
 
 
 if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Change quality of images in a folder")
+    parser = argparse.ArgumentParser(
+        description="Change quality of images in a folder and its subfolders"
+    )
     parser.add_argument(
         "source_folder", type=str, help="Input folder containing images"
     )
     parser.add_argument(
         "quality", type=int, default=70, nargs="?", help="Image quality (0-100)"
     )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Worker processes, 0 uses every CPU core (default: 1, serial)",
+    )
+    parser.add_argument(
+        "--max-size",
+        type=int,
+        help="Scale images down to fit in MAX_SIZE x MAX_SIZE pixels, e.g. 1600",
+    )
+    parser.add_argument(
+        "--target-kb",
+        type=int,
+        help="Highest quality (up to QUALITY) whose JPEG/WebP file fits in TARGET_KB kilobytes",
+    )
+    parser.add_argument(
+        "--output",
+        type=str,
+        help="Output folder (default: <source_folder>/<source_folder>_READY, excluded from the scan)",
+    )
     args = parser.parse_args()
 
-    output_folder = os.path.join(
+    output_folder = args.output or os.path.join(
         args.source_folder, args.source_folder.split(os.path.sep)[-1] + "_READY"
     )
 
-    change_quality(args.source_folder, output_folder, args.quality)
+    workers = args.workers or os.cpu_count()
+    counts = change_quality(
+        args.source_folder,
+        output_folder,
+        args.quality,
+        workers,
+        args.max_size,
+        args.target_kb,
+    )
 
-    print("\nEnd.")
+    print(
+        f"\n{counts['processed']} images processed, {counts['unchanged']} unchanged, {counts['failed']} failed."
+    )
+    if counts["duplicates"]:
+        print(
+            f"{counts['duplicates']} duplicates linked, {counts['cpu_saved']:.2f} s of CPU time saved."
+        )
+    if args.target_kb and counts["processed"]:
+        print(f"Average encodes per image: {counts['encodes'] / counts['processed']:.2f}")
+    print("End.")